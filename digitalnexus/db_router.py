@@ -0,0 +1,142 @@
+"""
+Чтение каталога с реплик.
+
+ReplicaRouter отправляет чтения Product / Category / City на одну из
+реплик (REPLICA_DATABASES), всё остальное — на default. Запросы
+закрепляются за основной базой:
+
+* после первой записи в запросе — чтобы прочитать только что записанное;
+* внутри транзакции на default;
+* во вьюхах с @use_primary (checkout_start, pay_order) — и ещё
+  REPLICA_PIN_SECONDS секунд для следующих запросов этого браузера
+  (cookie), пока реплики догоняют основную базу.
+
+Вне запроса (команды, воркеры) реплики не используются.
+"""
+import contextvars
+import random
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_MODELS = {"store.product", "store.category", "store.city"}
+PIN_COOKIE = "db_primary"
+
+_request_pin = contextvars.ContextVar("db_request_pin", default=None)
+
+
+class RequestPin:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.sticky = False
+        # одна реплика на весь запрос: у разных реплик разное отставание
+        self.replica = None
+
+
+def _replicas():
+    return getattr(settings, "REPLICA_DATABASES", [])
+
+
+def pin_to_primary(sticky=False):
+    """
+    Закрепить текущий запрос за основной базой; sticky — и следующие
+    запросы на REPLICA_PIN_SECONDS секунд.
+    """
+    pin = _request_pin.get()
+    if pin is not None:
+        pin.pinned = True
+        pin.sticky = pin.sticky or sticky
+
+
+def use_primary(view):
+    """
+    Декоратор вьюхи, после которой чтения должны видеть её записи.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            pin_to_primary(sticky=True)
+            return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            pin_to_primary(sticky=True)
+            return view(request, *args, **kwargs)
+    return inner
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower not in REPLICA_MODELS:
+            return DEFAULT_DB_ALIAS
+        pin = _request_pin.get()
+        if pin is None or pin.pinned or not _replicas():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if pin.replica is None:
+            pin.replica = random.choice(_replicas())
+        return pin.replica
+
+    def db_for_write(self, model, **hints):
+        # после записи до конца запроса читаем с основной базы
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *_replicas()}
+        return obj1._state.db in aliases and obj2._state.db in aliases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # реплики получают схему репликацией (локально — sync_replicas)
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware:
+    """
+    Завести на запрос отметку закрепления и продлить её cookie после
+    вьюх с @use_primary.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        pin, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_pin.reset(token)
+        return self.finish(pin, response)
+
+    async def __acall__(self, request):
+        pin, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_pin.reset(token)
+        return self.finish(pin, response)
+
+    def start(self, request):
+        pin = RequestPin(pinned=PIN_COOKIE in request.COOKIES)
+        return pin, _request_pin.set(pin)
+
+    def finish(self, pin, response):
+        if pin.sticky:
+            response.set_cookie(
+                PIN_COOKIE, "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,274 @@
+"""
+Метрики запросов: число и время SQL, время рендера шаблонов и общее время.
+
+InstrumentationMiddleware отдаёт их в заголовке Server-Timing и копит
+в памяти процесса; metrics_view выводит накопленное в текстовом формате
+Prometheus — только staff, по METRICS_TOKEN или с адресов METRICS_ALLOWED_IPS.
+Время шаблонов считает бэкенд InstrumentedDjangoTemplates (TEMPLATES.BACKEND).
+Вьюхи объявляют бюджет запросов декоратором query_budget — превышение
+пишется в лог и в метрики, а в тестах роняет тест
+(см. digitalnexus.testing.QueryBudgetMixin).
+"""
+import contextvars
+import hmac
+import ipaddress
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template as DjangoTemplate
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def query_budget(limit):
+    """
+    Объявить для вьюхи максимум SQL-запросов на один запрос.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+class RequestStats:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+
+# ---------- SQL ----------
+# Обёртка ставится на каждое соединение при его создании и смотрит в
+# contextvar: так учитываются и запросы из потоков sync_to_async
+# (async-вьюхи под ASGI), куда контекст копируется asgiref.
+def _sql_wrapper(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_count += 1
+        stats.sql_time += time.perf_counter() - started
+
+
+def _install_sql_wrapper(sender, connection, **kwargs):
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+connection_created.connect(_install_sql_wrapper)
+
+
+# ---------- ВРЕМЯ РЕНДЕРА ШАБЛОНОВ ----------
+# render() / render_to_string() получают шаблон у бэкенда — он отдаёт
+# обёртку, которая считает время; {% include %} и {% extends %} идут через
+# движок мимо бэкенда, поэтому вложенные шаблоны не считаются дважды
+class TimedTemplate(DjangoTemplate):
+    def render(self, context=None, request=None):
+        stats = _current_stats.get()
+        if stats is None:
+            return super().render(context, request)
+
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+# ---------- НАКОПЛЕННЫЕ МЕТРИКИ ----------
+class ViewMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.duration_seconds = 0.0
+        self.duration_buckets = [0] * len(DURATION_BUCKETS)
+        self.budget_exceeded = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, stats, duration, over_budget):
+        with self._lock:
+            metrics = self._views.setdefault(view, ViewMetrics())
+            metrics.requests += 1
+            metrics.sql_queries += stats.sql_count
+            metrics.sql_seconds += stats.sql_time
+            metrics.template_seconds += stats.template_time
+            metrics.duration_seconds += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    metrics.duration_buckets[i] += 1
+            if over_budget:
+                metrics.budget_exceeded += 1
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        with self._lock:
+            views = sorted(self._views.items())
+
+        lines = []
+
+        def metric(name, kind, help_text, value_of):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for view, metrics in views:
+                lines.append(f'{name}{{view="{view}"}} {value_of(metrics)}')
+
+        metric("digitalnexus_requests_total", "counter",
+               "Обработано запросов", lambda m: m.requests)
+        metric("digitalnexus_sql_queries_total", "counter",
+               "Выполнено SQL-запросов", lambda m: m.sql_queries)
+        metric("digitalnexus_sql_seconds_total", "counter",
+               "Суммарное время SQL, секунд", lambda m: f"{m.sql_seconds:.6f}")
+        metric("digitalnexus_template_seconds_total", "counter",
+               "Суммарное время рендера шаблонов, секунд", lambda m: f"{m.template_seconds:.6f}")
+        metric("digitalnexus_query_budget_exceeded_total", "counter",
+               "Запросов сверх бюджета SQL", lambda m: m.budget_exceeded)
+
+        name = "digitalnexus_request_duration_seconds"
+        lines.append(f"# HELP {name} Время обработки запроса, секунд")
+        lines.append(f"# TYPE {name} histogram")
+        for view, metrics in views:
+            for bound, count in zip(DURATION_BUCKETS, metrics.duration_buckets):
+                lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{view="{view}",le="+Inf"}} {metrics.requests}')
+            lines.append(f'{name}_sum{{view="{view}"}} {metrics.duration_seconds:.6f}')
+            lines.append(f'{name}_count{{view="{view}"}} {metrics.requests}')
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    # для маршрутов без name view_name — путь к функции вьюхи
+    return match.view_name
+
+
+def _budget_of(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return getattr(match.func, "query_budget", None)
+
+
+class InstrumentationMiddleware:
+    # работает и под WSGI, и под ASGI — не заставляет Django гонять
+    # async-вьюхи через поток синхронного middleware
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # соединения, открытые до загрузки middleware (миграции, тесты)
+        for connection in connections.all(initialized_only=True):
+            _install_sql_wrapper(None, connection)
+
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    def finish(self, request, response, stats, duration):
+        view = _view_name(request)
+        budget = _budget_of(request)
+        over_budget = budget is not None and stats.sql_count > budget
+        if over_budget:
+            logger.warning(
+                "%s: %d SQL-запросов при бюджете %d", view, stats.sql_count, budget
+            )
+
+        registry.observe(view, stats, duration, over_budget)
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={stats.sql_time * 1000:.1f};desc="{stats.sql_count} queries"',
+            f"tpl;dur={stats.template_time * 1000:.1f}",
+            f"total;dur={duration * 1000:.1f}",
+        ])
+        return response
+
+
+def _metrics_allowed(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_staff:
+        return True
+
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in getattr(settings, "METRICS_ALLOWED_IPS", ())
+    )
+
+
+def metrics_view(request):
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,62 @@
+"""
+Пагинатор с приблизительным числом строк.
+
+COUNT(*) по таблице в миллионы строк (ключи товаров) читает её целиком, и
+страница списка в админке ждёт секунды. EstimatedCountPaginator берёт
+оценку из статистики планировщика:
+
+* PostgreSQL — число строк из плана запроса (EXPLAIN), с любыми фильтрами;
+* SQLite — sqlite_stat1 после ANALYZE, только для запроса без фильтров.
+
+Если оценки нет или она меньше exact_threshold — обычный COUNT(*):
+небольшие выборки считаются быстро, и там номер последней страницы точный.
+"""
+import json
+
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """
+    Оценка числа строк queryset без COUNT(*) или None, если оценки нет.
+    """
+    connection = connections[queryset.db]
+
+    if connection.vendor == "postgresql":
+        sql, params = queryset.order_by().values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    if connection.vendor == "sqlite" and not queryset.query.where:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT stat FROM sqlite_stat1 WHERE tbl = %s",
+                    [queryset.model._meta.db_table],
+                )
+                rows = cursor.fetchall()
+        except DatabaseError:
+            # ANALYZE ни разу не запускали — таблицы статистики нет
+            return None
+        # первое число stat — строк в индексе; у частичных индексов меньше
+        counts = [int(stat.split()[0]) for stat, in rows if stat]
+        return max(counts) if counts else None
+
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    exact_threshold = 10_000
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.exact_threshold:
+            return super().count
+        return estimate
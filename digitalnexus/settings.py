@@ -41,11 +41,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # первым — чтобы время и SQL считались по всему стеку
+    'digitalnexus.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # статика из STATIC_ROOT — до сессий и прочего, что ей не нужно
+    'digitalnexus.staticfiles.StaticFilesMiddleware',
+    'digitalnexus.db_router.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.cart.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +60,8 @@ ROOT_URLCONF = 'digitalnexus.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, который считает время рендера для Server-Timing
+        'BACKEND': 'digitalnexus.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -73,12 +80,147 @@ WSGI_APPLICATION = 'digitalnexus.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_PROFILE выбирает профиль:
+#   sqlite (по умолчанию) — файл db.sqlite3 в режиме WAL: читатели не ждут
+#       писателя, busy_timeout вместо мгновенного "database is locked",
+#       транзакции BEGIN IMMEDIATE — писатели встают в очередь сразу,
+#       а не падают при повышении блокировки;
+#   sqlite-plain — настройки SQLite по умолчанию (для сравнения в loadtest);
+#   postgres — PostgreSQL из переменных DB_NAME/DB_USER/DB_PASSWORD/DB_HOST/
+#       DB_PORT. Соединения живут DB_CONN_MAX_AGE секунд с проверкой перед
+#       использованием; DB_POOL=1 включает пул psycopg (нужен psycopg[pool]),
+#       тогда постоянные соединения отключаются — их держит пул.
+
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA busy_timeout=5000;'
+    'PRAGMA temp_store=MEMORY;'
+    'PRAGMA cache_size=-20000;'
+    'PRAGMA mmap_size=134217728;'
+)
+
+if DB_PROFILE == 'postgres':
+    DB_POOL = os.environ.get('DB_POOL', '0').lower() in ('1', 'true', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'digitalnexus'),
+            'USER': os.environ.get('DB_USER', 'digitalnexus'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': not DB_POOL,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+                    'timeout': 10,
+                },
+            } if DB_POOL else {},
+        }
     }
-}
+elif DB_PROFILE == 'sqlite-plain':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'init_command': SQLITE_PRAGMAS,
+                'transaction_mode': 'IMMEDIATE',
+                # сколько ждать блокировку на уровне драйвера, секунд
+                'timeout': 5,
+            },
+        }
+    }
+
+
+# Реплики для чтения каталога (digitalnexus.db_router). DB_REPLICAS — через
+# запятую: хосты реплик для postgres или пути к файлам для sqlite (локальная
+# имитация; копии основной базы делает manage.py sync_replicas).
+# В тестах реплики зеркалят default.
+REPLICA_DATABASES = []
+for i, location in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(','))):
+    alias = f'replica_{i}'
+    replica = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if DB_PROFILE == 'postgres':
+        replica['HOST'] = location.strip()
+    else:
+        replica['NAME'] = BASE_DIR / location.strip()
+    DATABASES[alias] = replica
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['digitalnexus.db_router.ReplicaRouter'] if REPLICA_DATABASES else []
+
+# Сколько секунд после оформления заказа читать с основной базы
+REPLICA_PIN_SECONDS = 5
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_BACKEND: locmem (по умолчанию), file или redis.
+# locmem у каждого процесса свой — при нескольких воркерах берите file/redis.
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', str(BASE_DIR / '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'digitalnexus',
+        }
+    }
+
+# Время жизни закэшированных запросов и фрагментов витрины, секунд
+STORE_CACHE_TIMEOUT = int(os.environ.get('STORE_CACHE_TIMEOUT', 60 * 15))
+
+# Каталог: товаров на странице по умолчанию и верхняя граница для ?page_size=
+CATALOG_PAGE_SIZE = 24
+CATALOG_PAGE_SIZE_MAX = 96
+# нижние границы ценовых диапазонов гистограммы каталога (store.facets)
+CATALOG_PRICE_BUCKETS = (0, 500, 1000, 2000, 5000)
+
+# Заказов на странице истории (/profile/orders/)
+ORDER_HISTORY_PAGE_SIZE = 20
+
+# Корзина (store.cart): "cookie" — подписанная cookie, "cache" — кэш
+# (нужен общий для всех процессов: redis или file), "session" — сессия в БД.
+# cookie и cache не пишут в БД при изменении корзины
+CART_STORAGE = os.environ.get('CART_STORAGE', 'cookie')
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+CART_CACHE_ALIAS = 'default'
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Сколько дней хранится дневная статистика продаж (store.stats)
+STATS_RETENTION_DAYS = 90
+
+# Сколько секунд ключи держатся за неоплаченным заказом (store.keys.hold_keys);
+# просроченные резервы снимает manage.py release_expired_holds
+KEY_HOLD_SECONDS = 15 * 60
 
 
 # Password validation
@@ -116,6 +258,29 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'store' / 'static']
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic собирает наборы, даёт имена с хэшем и сжимает (gzip/brotli);
+# раздаёт собранное digitalnexus.staticfiles.StaticFilesMiddleware
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'digitalnexus.staticfiles.BundledStaticFilesStorage',
+    },
+}
+
+# Наборы CSS: имя собранного файла -> исходники в порядке подключения.
+# Набор лежит в той же папке, что и исходники, — относительные url() не ломаются
+STATIC_BUNDLES = {
+    'store/css/base/bundle.css': [
+        'store/css/base/base.css',
+        'store/css/base/header.css',
+        'store/css/base/footer.css',
+        'store/css/base/responsive.css',
+    ],
+}
 TEMPLATES[0]['DIRS'] = [BASE_DIR / 'store' / 'templates']
 
 # Default primary key field type
@@ -129,3 +294,30 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 AUTH_USER_MODEL = 'store.CustomUser'
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+
+# Очередь исходящей почты (store.mail): в продакшене письма отправляет
+# manage.py run_mail_worker, в разработке — фоновый поток самого процесса
+MAIL_QUEUE_IN_PROCESS = os.environ.get('MAIL_QUEUE_IN_PROCESS', str(DEBUG)).lower() in ('1', 'true', 'yes')
+MAIL_MAX_ATTEMPTS = 5
+MAIL_RETRY_BASE_SECONDS = 60
+
+# Производные картинок (store.images): в продакшене их строит
+# manage.py build_image_derivatives --watch, в разработке — фоновый поток
+IMAGE_DERIVATIVES_IN_PROCESS = os.environ.get('IMAGE_DERIVATIVES_IN_PROCESS', str(DEBUG)).lower() in ('1', 'true', 'yes')
+
+# Оплата (store.payments): провайдер для новых заказов и секрет подписи
+# вебхуков заглушки. Заглушка по умолчанию — только в разработке, в
+# продакшене провайдер задаётся явно. Ключи оплаченным заказам выдаёт
+# manage.py fulfill_orders, в разработке — фоновый поток процесса
+PAYMENT_PROVIDER = os.environ.get('PAYMENT_PROVIDER', 'stub' if DEBUG else '')
+PAYMENT_STUB_SECRET = os.environ.get('PAYMENT_STUB_SECRET', '')
+PAYMENTS_FULFILL_IN_PROCESS = os.environ.get('PAYMENTS_FULFILL_IN_PROCESS', str(DEBUG)).lower() in ('1', 'true', 'yes')
+
+# /metrics (digitalnexus.instrumentation): кроме staff — сборщик с заголовком
+# Authorization: Bearer <METRICS_TOKEN> или с адресов/сетей METRICS_ALLOWED_IPS
+# (REMOTE_ADDR: за прокси это адрес прокси, не клиента)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+# Максимальный размер загружаемого аватара, байт
+AVATAR_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
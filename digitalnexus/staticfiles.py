@@ -0,0 +1,217 @@
+"""
+Сборка и раздача статики.
+
+BundledStaticFilesStorage при collectstatic склеивает и минифицирует
+наборы CSS из STATIC_BUNDLES, даёт всем файлам имена с хэшем содержимого
+(ManifestStaticFilesStorage) и кладёт рядом сжатые копии .gz и .br
+(brotli — если установлен пакет brotli).
+
+StaticFilesMiddleware отдаёт собранное из STATIC_ROOT без похода во вьюхи:
+выбирает сжатую копию по Accept-Encoding, а файлам с хэшем в имени ставит
+Cache-Control immutable на год — повторный визит не делает запросов
+за статикой вовсе.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # сжатие brotli необязательно
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".txt", ".xml", ".html", ".map")
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+MUTABLE_MAX_AGE = 60
+
+
+# ---------- МИНИФИКАЦИЯ ----------
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_AROUND = re.compile(r"\s*([{};,>])\s*")
+# пробел перед ":" не трогаем — в селекторе "a :hover" он значимый
+_CSS_AFTER_COLON = re.compile(r":\s+")
+
+
+def minify_css(text):
+    """
+    Простая минификация CSS: без комментариев и лишних пробелов.
+    """
+    text = _CSS_COMMENT.sub("", text)
+    text = _CSS_SPACE.sub(" ", text)
+    text = _CSS_AROUND.sub(r"\1", text)
+    text = _CSS_AFTER_COLON.sub(":", text)
+    return text.replace(";}", "}").strip()
+
+
+def bundles():
+    return getattr(settings, "STATIC_BUNDLES", {})
+
+
+# ---------- ХРАНИЛИЩЕ ----------
+class BundledStaticFilesStorage(ManifestStaticFilesStorage):
+    # отсутствующий в манифесте файл отдаётся по исходному имени,
+    # а не роняет рендер страницы
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # файла нет и на диске (collectstatic не запускали — тесты)
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            for bundle_name, sources in bundles().items():
+                self._build_bundle(bundle_name, sources, paths)
+
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if not dry_run and isinstance(hashed_name, str):
+                self._compress(hashed_name)
+
+    def _build_bundle(self, bundle_name, sources, paths):
+        parts = []
+        for source in sources:
+            storage, path = paths[source]
+            with storage.open(path) as fh:
+                parts.append(fh.read().decode("utf-8"))
+
+        content = minify_css("\n".join(parts))
+        if self.exists(bundle_name):
+            self.delete(bundle_name)
+        self._save(bundle_name, ContentFile(content.encode("utf-8")))
+        paths[bundle_name] = (self, bundle_name)
+
+    def _compress(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as fh:
+            content = fh.read()
+
+        variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", brotli.compress(content)))
+
+        for suffix, compressed in variants:
+            # сжатие, которое ничего не дало, не храним
+            if len(compressed) >= len(content):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
+
+
+# ---------- РАЗДАЧА ----------
+def accepted_encodings(header):
+    """
+    Разобрать Accept-Encoding в {кодировка: q}. Кодировка без q — это q=1,
+    некорректное значение q считается нулём (кодировка не принимается).
+    """
+    result = {}
+    for item in header.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[coding.lower()] = q
+    return result
+
+
+class StaticFilesMiddleware:
+    """
+    Отдать файл из STATIC_ROOT, если путь начинается со STATIC_URL.
+    """
+
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = str(settings.STATIC_ROOT) if settings.STATIC_ROOT else None
+        self._immutable = None
+
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.match(request)
+        if response is not None:
+            return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # stat() и open() файла — дешевле, чем уход в поток
+        response = self.match(request)
+        if response is not None:
+            return response
+        return await self.get_response(request)
+
+    def match(self, request):
+        if self.root and request.path.startswith(self.prefix) and request.method in ("GET", "HEAD"):
+            return self.serve(request, request.path[len(self.prefix):])
+        return None
+
+    def immutable_names(self):
+        # хэшированные имена из манифеста collectstatic
+        if self._immutable is None:
+            hashed_files = getattr(staticfiles_storage, "hashed_files", {})
+            self._immutable = set(hashed_files.values())
+        return self._immutable
+
+    def serve(self, request, name):
+        path = os.path.normpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        if not was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"), stat.st_mtime):
+            return HttpResponseNotModified()
+
+        content_type, _ = mimetypes.guess_type(path)
+        accepted = accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        serve_path, encoding = path, None
+        # порядок — наш (brotli меньше); q=0 — клиент кодировку запретил,
+        # "*" покрывает кодировки, не названные явно
+        for candidate, suffix in self.ENCODINGS:
+            if accepted.get(candidate, accepted.get("*", 0)) > 0 and os.path.isfile(path + suffix):
+                serve_path, encoding = path + suffix, candidate
+                break
+
+        response = FileResponse(open(serve_path, "rb"), content_type=content_type or "application/octet-stream")
+        # FileResponse подставляет имя файла (.gz/.br) — для статики не нужно
+        response.headers.pop("Content-Disposition", None)
+        if encoding:
+            response["Content-Encoding"] = encoding
+        if name.endswith(COMPRESSIBLE_EXTENSIONS):
+            response["Vary"] = "Accept-Encoding"
+        response["Last-Modified"] = http_date(stat.st_mtime)
+
+        if name.replace(os.sep, "/") in self.immutable_names():
+            response["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            response["Cache-Control"] = f"public, max-age={MUTABLE_MAX_AGE}"
+        return response
@@ -0,0 +1,25 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+
+class QueryBudgetMixin:
+    """
+    Примесь к TestCase: проверка, что вьюха укладывается в свой query_budget.
+    """
+
+    def assertWithinQueryBudget(self, url, method="get", **kwargs):
+        view = resolve(url).func
+        budget = getattr(view, "query_budget", None)
+        self.assertIsNotNone(budget, f"У вьюхи для {url} не объявлен query_budget")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, **kwargs)
+
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            f"{url}: {len(queries)} SQL-запросов при бюджете {budget}:\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries),
+        )
+        return response
@@ -1,6 +1,34 @@
-from django.contrib import admin
+import io
+
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
-from .models import Category, Product, ProductKey, CustomUser
+from django.db import transaction
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import path, reverse
+from django.utils import timezone
+
+from digitalnexus.paginator import EstimatedCountPaginator
+
+from .keys import import_keys, iter_key_lines
+from .models import (
+    Category,
+    CustomUser,
+    OutboundEmail,
+    Product,
+    ProductKey,
+    reconcile_all_counters,
+    suppress_counter_signals,
+)
+
+
+class ImportKeysForm(forms.Form):
+    file = forms.FileField(label="Файл с ключами (.txt или .csv)")
+    encoding = forms.ChoiceField(
+        label="Кодировка",
+        choices=(("utf-8-sig", "UTF-8"), ("cp1251", "Windows-1251")),
+        initial="utf-8-sig",
+    )
 
 
 # === КАСТОМНЫЙ ПОЛЬЗОВАТЕЛЬ ===
@@ -37,10 +65,137 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('category',)
     search_fields = ('name', 'description')
     ordering = ('name',)
+    actions = ('import_keys_action',)
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:product_id>/import-keys/',
+                self.admin_site.admin_view(self.import_keys_view),
+                name='store_product_import_keys',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    @admin.action(description='Загрузить ключи из файла')
+    def import_keys_action(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, 'Выберите ровно один товар', messages.ERROR)
+            return None
+        return redirect('admin:store_product_import_keys', product_id=queryset.get().pk)
+
+    def import_keys_view(self, request, product_id):
+        product = get_object_or_404(Product, pk=product_id)
+
+        if request.method == 'POST':
+            form = ImportKeysForm(request.POST, request.FILES)
+            if form.is_valid():
+                upload = form.cleaned_data['file']
+                is_csv = upload.name.lower().endswith('.csv')
+
+                # читаем загруженный файл потоком, построчно
+                encoding = form.cleaned_data['encoding']
+                stream = io.TextIOWrapper(upload.open('rb'), encoding=encoding, newline='')
+                try:
+                    result = import_keys(product, iter_key_lines(stream, is_csv=is_csv))
+                except UnicodeDecodeError:
+                    # пачки до ошибки уже сохранены — повторная загрузка их пропустит
+                    form.add_error('encoding', 'Файл не в выбранной кодировке. Выберите другую и загрузите снова.')
+                else:
+                    self.message_user(request, f'{product}: {result}', messages.SUCCESS)
+                    return redirect(reverse('admin:store_product_change', args=[product.pk]))
+        else:
+            form = ImportKeysForm()
+
+        return render(request, 'admin/store/product/import_keys.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Загрузка ключей: {product}',
+            'product': product,
+            'form': form,
+        })
 
 
 # === КЛЮЧИ / АККАУНТЫ ===
 @admin.register(ProductKey)
 class ProductKeyAdmin(admin.ModelAdmin):
-    list_display = ('product',)
-    search_fields = ('product__name',)
+    list_display = ('key_value', 'product', 'is_sold', 'is_active', 'reserved_until', 'created_at')
+    list_select_related = ('product',)
+    list_filter = ('is_sold', 'is_active')
+    # поиск — точное совпадение ключа по уникальному индексу (get_search_results)
+    search_fields = ('key_value',)
+    search_help_text = 'Ключ целиком'
+    ordering = ('-id',)
+    raw_id_fields = ('product', 'reserved_order', 'order_item')
+    # ключей миллионы: оценка числа строк вместо COUNT(*) по всей таблице
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('deactivate_keys', 'mark_keys_sold', 'delete_keys')
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(key_value=search_term), False
+
+    def get_actions(self, request):
+        # стандартное удаление грузит и удаляет ключи по одному
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def _bulk(self, request, queryset, apply, message):
+        """
+        Применить apply к выбранным ключам одним запросом и один раз
+        пересчитать счётчики затронутых товаров.
+        """
+        queryset = queryset.order_by()
+        with transaction.atomic():
+            product_ids = list(queryset.values_list('product_id', flat=True).distinct())
+            affected = apply(queryset)
+            reconcile_all_counters(product_ids=product_ids)
+        self.message_user(request, f'{message}: {affected}', messages.SUCCESS)
+
+    @admin.action(description='Деактивировать ключи', permissions=['change'])
+    def deactivate_keys(self, request, queryset):
+        self._bulk(
+            request, queryset,
+            lambda keys: keys.update(is_active=False),
+            'Деактивировано ключей',
+        )
+
+    @admin.action(description='Отметить проданными', permissions=['change'])
+    def mark_keys_sold(self, request, queryset):
+        self._bulk(
+            request, queryset,
+            lambda keys: keys.update(is_sold=True, is_active=False, reserved_order=None, reserved_until=None),
+            'Отмечено проданными',
+        )
+
+    @admin.action(description='Удалить ключи', permissions=['delete'])
+    def delete_keys(self, request, queryset):
+        # обычный delete(): каскады и сигналы как везде, но сигналы ключей
+        # внутри suppress_counter_signals ничего не делают — счётчики
+        # пересчитываются один раз в _bulk
+        def delete(keys):
+            with suppress_counter_signals():
+                return keys.delete()[0]
+
+        self._bulk(request, queryset, delete, 'Удалено ключей')
+
+
+# === ИСХОДЯЩАЯ ПОЧТА ===
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    readonly_fields = ('to', 'subject', 'body', 'attempts', 'last_error', 'created_at', 'sent_at')
+    actions = ('retry_now',)
+
+    @admin.action(description="Отправить повторно")
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=OutboundEmail.STATUS_SENT).update(
+            status=OutboundEmail.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"Поставлено в очередь писем: {updated}")
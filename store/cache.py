@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# Пространства версий: при изменении данных версия увеличивается, и все
+# ключи со старой версией просто перестают читаться (и доживают до TTL)
+PRODUCTS = "products"
+CATEGORIES = "categories"
+
+
+def _timeout():
+    return getattr(settings, "STORE_CACHE_TIMEOUT", 60 * 15)
+
+
+def get_version(namespace):
+    version = cache.get(f"ver:{namespace}")
+    if version is None:
+        version = 1
+        # add, а не set — не затираем версию, которую успел записать другой процесс
+        cache.add(f"ver:{namespace}", version, timeout=None)
+    return version
+
+
+async def aget_version(namespace):
+    version = await cache.aget(f"ver:{namespace}")
+    if version is None:
+        version = 1
+        await cache.aadd(f"ver:{namespace}", version, timeout=None)
+    return version
+
+
+def bump_version(namespace):
+    try:
+        cache.incr(f"ver:{namespace}")
+    except ValueError:
+        # ключа версии ещё нет (или вытеснен) — начинаем заново
+        cache.set(f"ver:{namespace}", 2, timeout=None)
+
+
+def versioned_key(namespace, name):
+    return f"{namespace}:{get_version(namespace)}:{name}"
+
+
+def cached_query(namespace, name, loader):
+    """
+    Вернуть результат loader() из кэша под текущей версией namespace.
+
+    loader должен возвращать уже вычисленные данные (list, а не QuerySet).
+    """
+    key = versioned_key(namespace, name)
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        cache.set(key, value, timeout=_timeout())
+    return value
+
+
+async def acached_query(namespace, name, loader):
+    """
+    Асинхронный cached_query: loader — корутина-функция.
+    """
+    key = f"{namespace}:{await aget_version(namespace)}:{name}"
+    value = await cache.aget(key)
+    if value is None:
+        value = await loader()
+        await cache.aset(key, value, timeout=_timeout())
+    return value
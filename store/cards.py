@@ -0,0 +1,54 @@
+"""
+Карточки товаров для списков (главная, каталог, поиск).
+
+Списки не грузят Product целиком: описание (TextField без ограничения
+длины), даты, счётчики карточке не нужны. Запрос берёт через values()
+только поля карточки и название категории (JOIN в том же запросе), а из
+строк собираются лёгкие ProductCard — без модели, её состояния и
+дескрипторов полей.
+"""
+from django.core.files.storage import default_storage
+
+CARD_FIELDS = ("id", "slug", "name", "price", "image", "image_variants", "stock", "category__name")
+
+
+class ProductCard:
+    __slots__ = ("id", "slug", "name", "price", "image_url", "image_variants", "category_name", "in_stock")
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.slug = row["slug"]
+        self.name = row["name"]
+        self.price = row["price"]
+        self.image_variants = row["image_variants"] or {}
+        # оригинал — запасной <img> для браузеров без AVIF/WebP; уменьшенные
+        # копии идут в <source> тега picture по image_variants
+        self.image_url = default_storage.url(row["image"]) if row["image"] else ""
+        self.category_name = row["category__name"]
+        self.in_stock = row["stock"] > 0
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __repr__(self):
+        return f"<ProductCard {self.slug}>"
+
+
+def card_values(queryset, *extra):
+    """
+    queryset товаров -> строки с полями карточки (и extra, например поле
+    сортировки для курсора).
+    """
+    return queryset.values(*CARD_FIELDS, *extra)
+
+
+def product_cards(rows):
+    return [ProductCard(row) for row in rows]
+
+
+async def aproduct_cards(queryset):
+    """
+    Карточки по queryset товаров для асинхронных вьюх.
+    """
+    return [ProductCard(row) async for row in card_values(queryset).aiterator()]
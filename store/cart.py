@@ -0,0 +1,342 @@
+import secrets
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db.models import Count
+
+from .models import FREE_KEY, Product, ProductKey
+
+
+class CartLine:
+    def __init__(self, product, quantity, available):
+        self.product = product
+        self.quantity = quantity
+        self.available = available
+
+    @property
+    def subtotal(self):
+        return self.product.price * self.quantity
+
+    @property
+    def enough_keys(self):
+        return self.quantity <= self.available
+
+
+# ---------- ХРАНЕНИЕ КОРЗИНЫ ----------
+# Корзина — словарь {product_id (str): количество}. Где он лежит, задаёт
+# CART_STORAGE:
+#   "session" — в сессии (каждое изменение — запись в таблицу сессий);
+#   "cookie"  — в подписанной cookie: ни БД, ни кэша, для небольших корзин;
+#   "cache"   — в кэше: у анонима по токену из cookie, у пользователя по id.
+# В режимах cookie и cache изменение корзины в БД не пишет.
+class SessionCartStorage:
+    SESSION_KEY = "cart"
+
+    def __init__(self, request):
+        self.request = request
+
+    def load(self):
+        return self.request.session.get(self.SESSION_KEY, {})
+
+    async def aload(self):
+        return await self.request.session.aget(self.SESSION_KEY, {})
+
+    def save(self, data):
+        self.request.session[self.SESSION_KEY] = data
+
+    def merge_on_login(self):
+        # login() переносит данные сессии — корзина уже на месте
+        pass
+
+    def finish(self, response):
+        pass
+
+
+class SignedCookieCartStorage:
+    SALT = "store.cart"
+
+    def __init__(self, request):
+        self.request = request
+        self.pending = None
+
+    @classmethod
+    def encode(cls, data):
+        return signing.dumps(data, salt=cls.SALT, compress=True)
+
+    @classmethod
+    def decode(cls, value):
+        try:
+            data = signing.loads(value, salt=cls.SALT)
+        except signing.BadSignature:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def load(self):
+        if self.pending is not None:
+            return self.pending
+        value = self.request.COOKIES.get(settings.CART_COOKIE_NAME)
+        return self.decode(value) if value else {}
+
+    async def aload(self):
+        return self.load()
+
+    def save(self, data):
+        self.pending = data
+
+    def merge_on_login(self):
+        # cookie принадлежит браузеру и переживает вход
+        pass
+
+    def finish(self, response):
+        if self.pending is None:
+            return
+        if self.pending:
+            response.set_cookie(
+                settings.CART_COOKIE_NAME,
+                self.encode(self.pending),
+                max_age=settings.CART_COOKIE_AGE,
+                httponly=True,
+                samesite="Lax",
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        else:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite="Lax")
+
+
+class CacheCartStorage:
+    TOKEN_SALT = "store.cart.token"
+
+    def __init__(self, request):
+        self.request = request
+        self.cache = caches[settings.CART_CACHE_ALIAS]
+        self.new_token = None
+        self.drop_token = False
+
+    @staticmethod
+    def user_key(user_id):
+        return f"cart:user:{user_id}"
+
+    @staticmethod
+    def anonymous_key(token):
+        return f"cart:anon:{token}"
+
+    def _token(self):
+        if self.new_token:
+            return self.new_token
+        return self.request.get_signed_cookie(
+            settings.CART_COOKIE_NAME, default=None, salt=self.TOKEN_SALT
+        )
+
+    def _key(self, create=False):
+        user = self.request.user
+        if user.is_authenticated:
+            return self.user_key(user.pk)
+        token = self._token()
+        if token is None and create:
+            token = self.new_token = secrets.token_urlsafe(16)
+        return self.anonymous_key(token) if token else None
+
+    def load(self):
+        key = self._key()
+        return self.cache.get(key, {}) if key else {}
+
+    async def aload(self):
+        key = self._key()
+        return await self.cache.aget(key, {}) if key else {}
+
+    def save(self, data):
+        key = self._key(create=True)
+        if data:
+            self.cache.set(key, data, timeout=settings.CART_CACHE_TIMEOUT)
+        else:
+            self.cache.delete(key)
+
+    def merge_on_login(self):
+        """
+        Перенести анонимную корзину в корзину вошедшего пользователя.
+        """
+        token = self._token()
+        if not token:
+            return
+        anonymous = self.cache.get(self.anonymous_key(token), {})
+        if anonymous:
+            key = self.user_key(self.request.user.pk)
+            merged = self.cache.get(key, {})
+            for product_id, quantity in anonymous.items():
+                merged[product_id] = merged.get(product_id, 0) + quantity
+            self.cache.set(key, merged, timeout=settings.CART_CACHE_TIMEOUT)
+            self.cache.delete(self.anonymous_key(token))
+        self.drop_token = True
+
+    def finish(self, response):
+        if self.drop_token:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite="Lax")
+        elif self.new_token:
+            response.set_signed_cookie(
+                settings.CART_COOKIE_NAME,
+                self.new_token,
+                salt=self.TOKEN_SALT,
+                max_age=settings.CART_CACHE_TIMEOUT,
+                httponly=True,
+                samesite="Lax",
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+
+
+CART_STORAGES = {
+    "session": SessionCartStorage,
+    "cookie": SignedCookieCartStorage,
+    "cache": CacheCartStorage,
+}
+
+
+def get_cart_storage(request):
+    """
+    Хранилище корзины запроса — одно на запрос, его дописывает CartMiddleware.
+    """
+    storage = getattr(request, "_cart_storage", None)
+    if storage is None:
+        storage = request._cart_storage = CART_STORAGES[settings.CART_STORAGE](request)
+    return storage
+
+
+def merge_cart_on_login(request):
+    """
+    Вызывать сразу после login(): анонимная корзина переходит пользователю.
+    """
+    get_cart_storage(request).merge_on_login()
+
+
+class CartMiddleware:
+    """
+    Записать в ответ cookie корзины, если хранилище её поменяло.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.finish(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.finish(request, await self.get_response(request))
+
+    def finish(self, request, response):
+        storage = getattr(request, "_cart_storage", None)
+        if storage is not None:
+            storage.finish(response)
+        return response
+
+
+class Cart:
+    """
+    Корзина покупателя: {product_id (str): количество} в хранилище
+    из CART_STORAGE (см. выше).
+
+    Все товары корзины грузятся одним in_bulk, количество свободных ключей —
+    одним сгруппированным запросом, так что число запросов не зависит
+    от количества позиций.
+    """
+
+    def __init__(self, request):
+        self.storage = get_cart_storage(request)
+        self._data = None
+        self._lines = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.storage.load()
+        return self._data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def quantity(self, product_id):
+        return self.data.get(str(product_id), 0)
+
+    def lines(self):
+        if self._lines is None:
+            self._lines = self._load()
+        return self._lines
+
+    async def alines(self):
+        """
+        lines() для асинхронных вьюх (async ORM).
+        """
+        if self._lines is None:
+            if self._data is None:
+                self._data = await self.storage.aload()
+            products = await Product.objects.ain_bulk(self._ids())
+            # не aiterator(): у values_list с annotate он в Django 5.x
+            # выполняет запрос синхронно
+            available = {
+                product_id: free
+                async for product_id, free in self._free_keys(products)
+            }
+            self._lines = self._build(products, available)
+        return self._lines
+
+    def _ids(self):
+        return [int(product_id) for product_id in self.data]
+
+    def _free_keys(self, products):
+        return (
+            ProductKey.objects
+            .filter(FREE_KEY, product_id__in=list(products))
+            .order_by()
+            .values("product_id")
+            .annotate(free=Count("id"))
+            .values_list("product_id", "free")
+        )
+
+    def _load(self):
+        products = Product.objects.in_bulk(self._ids())
+        available = dict(self._free_keys(products))
+        return self._build(products, available)
+
+    def _build(self, products, available):
+        lines = []
+        for product_id, quantity in self.data.items():
+            product = products.get(int(product_id))
+            if product is None:
+                # товар удалили, пока он лежал в корзине
+                continue
+            lines.append(CartLine(product, quantity, available.get(product.id, 0)))
+        return lines
+
+    @property
+    def total_price(self):
+        return sum((line.subtotal for line in self.lines()), 0)
+
+    def set(self, product_id, quantity):
+        self.data[str(product_id)] = quantity
+        self.save()
+
+    def remove(self, product_id):
+        self.data.pop(str(product_id), None)
+        self.save()
+
+    def clear(self):
+        self._data = {}
+        self.save()
+
+    def save(self):
+        self.storage.save(self.data)
+        self._lines = None
@@ -0,0 +1,72 @@
+"""
+Условные GET для витринных страниц: ETag и ответ 304 без запроса данных
+страницы и без рендера шаблона.
+
+Валидатор страницы — корутина, которая дёшево (один агрегат или значение
+из кэша версий) возвращает (modified_at, parts) либо None, если страницы
+нет; из них собирается ETag. Last-Modified не отдаётся: время изменения
+товаров не видит ни удалений, ни смены категорий и счётчиков (они
+учитываются версиями кэша в parts), и клиент, присылающий один
+If-Modified-Since, получил бы устаревший 304. Политика по пользователю:
+
+* анонимам — Cache-Control public: ответ может хранить и перепроверять
+  CDN (Vary: Cookie ставит SessionMiddleware);
+* вошедшим — в ETag добавляется то, что выводит шапка (id, имя, аватар),
+  Cache-Control private — общий кэш такую страницу не хранит.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+SAFE_METHODS = ("GET", "HEAD")
+
+
+def make_etag(parts, user):
+    if user.is_authenticated:
+        parts = (*parts, "user", user.pk, user.get_username(), user.avatar.name or "")
+    digest = hashlib.md5(repr(parts).encode("utf-8"), usedforsecurity=False).hexdigest()
+    # слабый: байты страницы не повторяются (csrf-токен), смысл — тот же
+    return f'W/"{digest}"'
+
+
+def _set_validators(response, etag, user):
+    response.headers.setdefault("ETag", etag)
+    if user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+
+
+def conditional_page(validator):
+    """
+    Декоратор async-вьюхи: 304, если страница не менялась с прошлого раза.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return await view(request, *args, **kwargs)
+
+            user = await request.auser()
+            # сообщения выводятся при рендере — их нельзя «съесть» ответом 304
+            if len(get_messages(request)):
+                return await view(request, *args, **kwargs)
+
+            validators = await validator(request, *args, **kwargs)
+            if validators is None:
+                return await view(request, *args, **kwargs)
+
+            modified_at, parts = validators
+            etag = make_etag((modified_at, *parts), user)
+
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                _set_validators(response, etag, user)
+            return response
+
+        return inner
+    return decorator
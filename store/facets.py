@@ -0,0 +1,127 @@
+"""
+Фасеты каталога: число доступных товаров в каждой категории при текущем
+фильтре цены, границы цен и гистограмма по ценовым диапазонам.
+
+Всё берётся одним сгруппированным запросом по доступным товарам: группы
+(категория, диапазон цены), в каждой — сколько товаров всего, сколько
+попадает в фильтр цены и min/max цены. Дальше группы складываются в
+Python. Результат кэшируется по сигнатуре фильтра цены под версией
+PRODUCTS — любое изменение товаров его сбрасывает.
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Max, Min, Q, Value, When
+
+from . import cache as store_cache
+from .models import Product
+
+
+def parse_price(value):
+    """
+    Цена из GET-параметра; пустое или некорректное значение — None.
+    """
+    try:
+        price = Decimal(value)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def price_edges():
+    # нижние границы диапазонов гистограммы; последний открыт сверху
+    return tuple(getattr(settings, "CATALOG_PRICE_BUCKETS", (0, 500, 1000, 2000, 5000)))
+
+
+def price_filter(min_price=None, max_price=None):
+    q = Q()
+    if min_price is not None:
+        q &= Q(price__gte=min_price)
+    if max_price is not None:
+        q &= Q(price__lte=max_price)
+    return q
+
+
+def _bucket(edges):
+    # первый подходящий When — самая верхняя граница, не превышающая цену
+    return Case(
+        *[When(price__gte=edge, then=Value(i)) for i, edge in reversed(list(enumerate(edges)))],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _facet_rows(edges, min_price, max_price):
+    in_range = price_filter(min_price, max_price)
+    matched = Count("id", filter=in_range) if in_range else Count("id")
+    return (
+        Product.objects
+        .filter(is_available=True)
+        .order_by()
+        .annotate(bucket=_bucket(edges))
+        .values("category_id", "bucket")
+        .annotate(
+            total=Count("id"),
+            matched=matched,
+            min_price=Min("price"),
+            max_price=Max("price"),
+        )
+    )
+
+
+def _reduce(rows, edges):
+    counts = defaultdict(int)
+    histograms = defaultdict(lambda: [0] * len(edges))
+    low = high = None
+
+    for row in rows:
+        counts[row["category_id"]] += row["matched"]
+        # гистограмма — по всем ценам, чтобы было видно, куда расширить фильтр
+        histograms[row["category_id"]][row["bucket"]] += row["total"]
+        histograms[None][row["bucket"]] += row["total"]
+        low = row["min_price"] if low is None else min(low, row["min_price"])
+        high = row["max_price"] if high is None else max(high, row["max_price"])
+
+    return {
+        "counts": dict(counts),
+        "histograms": dict(histograms),
+        "min_price": low,
+        "max_price": high,
+    }
+
+
+async def acatalog_facets(min_price=None, max_price=None):
+    """
+    Фасеты каталога для фильтра цены: {"counts": {category_id: n},
+    "histograms": {category_id или None: [n по диапазонам]},
+    "min_price": ..., "max_price": ...}.
+    """
+    edges = price_edges()
+
+    async def load():
+        rows = [row async for row in _facet_rows(edges, min_price, max_price)]
+        return _reduce(rows, edges)
+
+    return await store_cache.acached_query(
+        store_cache.PRODUCTS, f"facets:{'-'.join(map(str, edges))}:{min_price}:{max_price}", load
+    )
+
+
+def histogram(facets, category_id=None):
+    """
+    Столбцы гистограммы для шаблона: границы диапазона, число товаров и
+    высота столбца в процентах от самого высокого.
+    """
+    edges = price_edges()
+    counts = facets["histograms"].get(category_id) or [0] * len(edges)
+    tallest = max(counts) or 1
+    return [
+        {
+            "low": edge,
+            "high": edges[i + 1] if i + 1 < len(edges) else None,
+            "count": count,
+            "percent": round(count * 100 / tallest),
+        }
+        for i, (edge, count) in enumerate(zip(edges, counts))
+    ]
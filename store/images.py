@@ -0,0 +1,240 @@
+"""
+Производные изображения: уменьшенные копии WebP/AVIF фиксированной ширины.
+
+Для Product.image и CustomUser.avatar после загрузки строятся копии
+каждой ширины из WIDTHS (больше оригинала не растягиваем). Имена файлов
+содержат хэш содержимого, поэтому их можно отдавать с вечным кэшем.
+Результат лежит в JSON-поле рядом с картинкой:
+
+    {"source": "products/x.png",
+     "webp": [[320, "derivatives/products/x-320.1a2b3c4d5e6f.webp"], ...],
+     "avif": [...]}
+
+Пустой словарь при заполненной картинке — «ещё не построено»: такие
+строки разбирает manage.py build_image_derivatives, а при
+IMAGE_DERIVATIVES_IN_PROCESS (разработка) — фоновый поток процесса.
+Когда картинку меняют или убирают, файлы прежних производных удаляются
+после коммита.
+"""
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, features
+
+from . import cache as store_cache
+
+logger = logging.getLogger(__name__)
+
+# ширины производных и JSON-поле, куда они записываются, по полю картинки
+WIDTHS = {
+    "image": (320, 480, 640, 960),
+    "avatar": (64, 128, 256),
+}
+VARIANT_FIELDS = {
+    "image": "image_variants",
+    "avatar": "avatar_variants",
+}
+QUALITY = {"webp": 80, "avif": 55}
+
+_executor = None
+
+
+def formats():
+    """
+    Форматы производных: AVIF — только если Pillow собран с его поддержкой.
+    """
+    available = ["webp"]
+    if features.check("avif"):
+        available.insert(0, "avif")
+    return available
+
+
+def is_image(upload):
+    """
+    Проверить, что загруженный файл действительно картинка, которую откроет Pillow.
+    """
+    try:
+        with Image.open(upload) as image:
+            image.verify()
+    except Exception:
+        return False
+    finally:
+        upload.seek(0)
+    return True
+
+
+# ---------- ПОСТРОЕНИЕ ----------
+def _hashed_name(field_name, source_name, width, fmt, content):
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    folder = "products" if field_name == "image" else "avatars"
+    return f"derivatives/{folder}/{stem}-{width}.{digest}.{fmt}"
+
+
+def _encode(image, width, fmt):
+    height = max(1, round(image.height * width / image.width))
+    resized = image.resize((width, height), Image.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, format=fmt.upper(), quality=QUALITY[fmt])
+    return buffer.getvalue()
+
+
+def build_variants(field_file, field_name):
+    """
+    Построить производные для файла картинки и вернуть словарь для JSON-поля.
+    """
+    with field_file.open("rb") as fh:
+        image = Image.open(fh)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+    widths = [w for w in WIDTHS[field_name] if w <= image.width] or [image.width]
+    variants = {"source": field_file.name}
+    for fmt in formats():
+        variants[fmt] = []
+        for width in widths:
+            content = _encode(image, width, fmt)
+            name = _hashed_name(field_name, field_file.name, width, fmt, content)
+            # одинаковое содержимое — одинаковое имя, повторно не пишем
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(content))
+            variants[fmt].append([width, name])
+    return variants
+
+
+def process(instance, field_name):
+    """
+    Построить производные для одного объекта и сохранить их одним UPDATE.
+    """
+    field_file = getattr(instance, field_name)
+    variants_field = VARIANT_FIELDS[field_name]
+    if not field_file:
+        return False
+
+    try:
+        variants = build_variants(field_file, field_name)
+    except (OSError, ValueError) as exc:
+        # битый файл: запоминаем ошибку, чтобы не пытаться снова на каждом проходе
+        logger.warning("Не удалось обработать %s: %s", field_file.name, exc)
+        variants = {"source": field_file.name, "error": str(exc)}
+
+    # UPDATE без сигналов; условие по имени файла — картинку могли сменить,
+    # пока мы её обрабатывали
+    updated = type(instance).objects.filter(
+        pk=instance.pk, **{field_name: field_file.name}
+    ).update(**{variants_field: variants})
+    if updated and field_name == "image":
+        store_cache.bump_version(store_cache.PRODUCTS)
+    return bool(updated)
+
+
+def pending(model, field_name):
+    """
+    Объекты с картинкой, для которой производные ещё не построены.
+    """
+    variants_field = VARIANT_FIELDS[field_name]
+    return (
+        model.objects
+        .exclude(**{field_name: ""})
+        .exclude(**{f"{field_name}__isnull": True})
+        .filter(**{variants_field: {}})
+        .only("pk", field_name, variants_field)
+    )
+
+
+def process_pending(batch_size=50):
+    """
+    Разобрать одну пачку очереди по всем моделям. Возвращает число обработанных.
+    """
+    from .models import CustomUser, Product
+
+    done = 0
+    for model, field_name in ((Product, "image"), (CustomUser, "avatar")):
+        for instance in pending(model, field_name)[:batch_size]:
+            done += process(instance, field_name)
+    return done
+
+
+# ---------- ПЛАНИРОВАНИЕ ----------
+def is_stale(instance, field_name):
+    field_file = getattr(instance, field_name)
+    variants = getattr(instance, VARIANT_FIELDS[field_name])
+    if not field_file:
+        # картинку убрали — прежние производные больше не нужны
+        return bool(variants)
+    return variants.get("source") != field_file.name
+
+
+def variant_files(variants):
+    # все форматы, а не только formats(): файлы могли построить на сборке Pillow с AVIF
+    return [name for fmt in QUALITY for _, name in variants.get(fmt, [])]
+
+
+def delete_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError as exc:
+            logger.warning("Не удалось удалить %s: %s", name, exc)
+
+
+def schedule(instance, field_name):
+    """
+    Поставить объект в очередь после смены картинки: сбросить производные
+    (пустой словарь — метка очереди), после коммита удалить файлы прежних
+    и, в разработке, сразу запустить поток.
+    """
+    variants_field = VARIANT_FIELDS[field_name]
+    old_files = variant_files(getattr(instance, variants_field))
+    if getattr(instance, variants_field):
+        type(instance).objects.filter(pk=instance.pk).update(**{variants_field: {}})
+        setattr(instance, variants_field, {})
+
+    # удаление — до постановки в поток: одинаковая картинка даст те же
+    # имена, и поток запишет их заново
+    if old_files:
+        transaction.on_commit(lambda: delete_files(old_files))
+
+    if not getattr(instance, field_name):
+        return
+
+    if getattr(settings, "IMAGE_DERIVATIVES_IN_PROCESS", False):
+        model, pk = type(instance), instance.pk
+        transaction.on_commit(lambda: _submit(model, pk, field_name))
+
+
+def _submit(model, pk, field_name):
+    global _executor
+    if _executor is None:
+        # один поток: обработка больших картинок ест много памяти
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="images")
+    _executor.submit(_process_in_thread, model, pk, field_name)
+
+
+def _process_in_thread(model, pk, field_name):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None:
+            process(instance, field_name)
+    except Exception:
+        logger.exception("Ошибка фоновой обработки картинки")
+    finally:
+        close_old_connections()
+
+
+# ---------- ШАБЛОНЫ ----------
+def srcset(variants, fmt):
+    """
+    Строка srcset с дескрипторами ширины: "a-320.webp 320w, a-640.webp 640w".
+    """
+    return ", ".join(
+        f"{default_storage.url(name)} {width}w" for width, name in variants.get(fmt, [])
+    )
+
@@ -0,0 +1,435 @@
+import csv
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import (
+    FREE_KEY,
+    Order,
+    ProductKey,
+    adjust_counters_bulk,
+    recalc_product_counters,
+    suppress_counter_signals,
+)
+
+
+class NotEnoughKeys(Exception):
+    """
+    Свободных ключей для товара меньше, чем нужно по заказу.
+    """
+
+    def __init__(self, product, requested, available):
+        self.product = product
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Не хватает ключей для «{product.name}»: нужно {requested}, есть {available}"
+        )
+
+
+def _locked(qs):
+    """
+    Заблокировать выбранные строки до конца транзакции.
+
+    На PostgreSQL/MySQL строки, уже захваченные другой транзакцией,
+    пропускаются (SKIP LOCKED) — параллельные покупатели не ждут друг друга.
+    На SQLite блокировок строк нет, там защищают условия в UPDATE.
+    """
+    if connection.features.has_select_for_update:
+        qs = qs.select_for_update(
+            skip_locked=connection.features.has_select_for_update_skip_locked
+        )
+    return qs
+
+
+# ключи товара по порядку id: SKIP LOCKED стоит внутри LATERAL, до LIMIT,
+# поэтому строки, захваченные другой транзакцией, заменяются следующими
+PG_FREE_KEYS = """
+    SELECT k.id, k.product_id, k.key_value
+    FROM unnest(%s::bigint[], %s::integer[]) AS wanted(product_id, n)
+    CROSS JOIN LATERAL (
+        SELECT id, product_id, key_value
+        FROM store_productkey
+        WHERE product_id = wanted.product_id
+          AND NOT is_sold
+          AND reserved_order_id IS NULL
+        ORDER BY id
+        LIMIT wanted.n
+        FOR UPDATE SKIP LOCKED
+    ) AS k
+    ORDER BY k.id
+"""
+
+
+def _free_keys_by_product(needed):
+    """
+    Свободные ключи сразу для нескольких товаров: needed — {product_id: n},
+    результат — {product_id: [(id, key_value), ...]}, не больше n на товар.
+
+    Блокировка должна срабатывать раньше лимита: иначе две параллельные
+    покупки выбирают одни и те же первые ключи, и вторая, пропустив их,
+    остаётся ни с чем. На PostgreSQL это один запрос с LATERAL (PG_FREE_KEYS),
+    на других СУБД с блокировками — запрос на товар. На SQLite блокировок
+    строк нет: первые ключи каждого товара отбирает ROW_NUMBER() одним запросом.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(PG_FREE_KEYS, [list(needed), list(needed.values())])
+            rows = cursor.fetchall()
+    elif connection.features.has_select_for_update:
+        rows = [
+            row
+            for product_id, n in needed.items()
+            for row in (
+                _locked(ProductKey.objects.filter(FREE_KEY, product_id=product_id).order_by("id"))
+                .values_list("id", "product_id", "key_value")[:n]
+            )
+        ]
+    else:
+        rows = (
+            ProductKey.objects
+            .filter(FREE_KEY, product_id__in=list(needed))
+            .annotate(position=Window(RowNumber(), partition_by=F("product_id"), order_by=F("id").asc()))
+            .filter(position__lte=max(needed.values()))
+            .order_by("id")
+            .values_list("id", "product_id", "key_value")
+        )
+
+    free = defaultdict(list)
+    for key_id, product_id, key_value in rows:
+        if len(free[product_id]) < needed[product_id]:
+            free[product_id].append((key_id, key_value))
+    return free
+
+
+def _shortage(items, chosen, taken):
+    """
+    NotEnoughKeys для товара, по которому UPDATE изменил меньше ключей, чем
+    было выбрано: chosen — {product_id: число ключей}, taken — ключи,
+    которые UPDATE успел изменить.
+    """
+    got = Counter(taken.values_list("product_id", flat=True))
+    for item in items:
+        if got[item.product_id] < chosen[item.product_id]:
+            return NotEnoughKeys(item.product, chosen[item.product_id], got[item.product_id])
+    return NotEnoughKeys(items[0].product, sum(chosen.values()), sum(got.values()))
+
+
+# ---------- РЕЗЕРВ ----------
+def hold_seconds():
+    return getattr(settings, "KEY_HOLD_SECONDS", 15 * 60)
+
+
+def hold_keys(order, until=None):
+    """
+    Зарезервировать под неоплаченный заказ конкретные ключи по всем позициям.
+
+    Резерв действует до until (по умолчанию — KEY_HOLD_SECONDS от текущего
+    момента). Склад товаров уменьшается сразу: в каталоге зарезервированные
+    ключи уже не видны. Число запросов не зависит от числа позиций: ключи
+    всех товаров выбираются одним запросом и резервируются одним UPDATE.
+    Если ключей не хватает — NotEnoughKeys, транзакция откатывается.
+    """
+    until = until or timezone.now() + timedelta(seconds=hold_seconds())
+
+    with transaction.atomic(savepoint=False):
+        items = list(order.items.select_related("product"))
+        if not items:
+            return
+
+        needed = defaultdict(int)
+        for item in items:
+            needed[item.product_id] += item.quantity
+
+        free = _free_keys_by_product(needed)
+        for item in items:
+            if len(free[item.product_id]) < needed[item.product_id]:
+                raise NotEnoughKeys(item.product, needed[item.product_id], len(free[item.product_id]))
+
+        key_ids = [key_id for keys in free.values() for key_id, _ in keys]
+        # FREE_KEY в условии — ключ, который успели взять другие, не уйдёт дважды
+        updated = (
+            ProductKey.objects
+            .filter(FREE_KEY, id__in=key_ids)
+            .update(reserved_order=order, reserved_until=until)
+        )
+        if updated != len(key_ids):
+            raise _shortage(items, needed, ProductKey.objects.filter(id__in=key_ids, reserved_order=order))
+
+        adjust_counters_bulk({product_id: (-n, 0) for product_id, n in needed.items()})
+
+
+def _release(keys, batch_size):
+    """
+    Снять резерв с пачки ключей и вернуть их на склад. Возвращает число снятых.
+    """
+    with transaction.atomic(savepoint=False):
+        rows = list(
+            _locked(keys.filter(is_sold=False, reserved_order__isnull=False).order_by("id"))
+            .values_list("id", "product_id")[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        # строки заблокированы — снимаются ровно выбранные ключи
+        ProductKey.objects.filter(id__in=[key_id for key_id, _ in rows]).update(
+            reserved_order=None, reserved_until=None
+        )
+
+        deltas = defaultdict(int)
+        for _, product_id in rows:
+            deltas[product_id] += 1
+        adjust_counters_bulk({product_id: (n, 0) for product_id, n in deltas.items()})
+    return len(rows)
+
+
+def release_expired_holds(product_ids=None, now=None, batch_size=1000):
+    """
+    Снять просроченные резервы (по индексу productkey_hold_idx) пачками.
+
+    product_ids — только для этих товаров: так checkout_start освобождает
+    ключи своей корзины, не дожидаясь фонового прохода.
+    Возвращает число освобождённых ключей.
+    """
+    # резерв оплаченного заказа держится до выдачи ключей (store.payments)
+    keys = ProductKey.objects.filter(
+        reserved_until__lte=now or timezone.now(),
+        reserved_order__status=Order.STATUS_NEW,
+    )
+    if product_ids is not None:
+        keys = keys.filter(product_id__in=list(product_ids))
+
+    released = 0
+    while True:
+        count = _release(keys, batch_size)
+        released += count
+        if count < batch_size:
+            return released
+
+
+def release_order_holds(orders, batch_size=1000):
+    """
+    Снять резервы неоплаченных заказов (queryset Order) — например, брошенных
+    прошлых заказов покупателя, когда он начинает новый.
+    """
+    keys = ProductKey.objects.filter(reserved_order__in=orders)
+
+    released = 0
+    while True:
+        count = _release(keys, batch_size)
+        released += count
+        if count < batch_size:
+            return released
+
+
+# ---------- ВЫДАЧА ----------
+def allocate_keys(order):
+    """
+    Выдать ключи по всем позициям заказа одной транзакцией.
+
+    Сначала выдаются ключи, зарезервированные под заказ в checkout_start.
+    Если резерв успел истечь и ключи ушли на склад, недостающие берутся из
+    свободных одним запросом на все товары. Проданные ключи — и из резерва,
+    и со склада — помечаются одним UPDATE, каждый ссылается на свою позицию
+    заказа (order_item). Счётчики всех товаров заказа сдвигаются одним UPDATE.
+    Возвращает список (product, key_value) в порядке позиций заказа.
+    Если ключей не хватает — NotEnoughKeys, транзакция откатывается.
+    """
+    # savepoint=False: внутри внешней транзакции (pay_order) ошибка
+    # откатывает её целиком, лишние SAVEPOINT не нужны
+    with transaction.atomic(savepoint=False):
+        held = defaultdict(list)
+        for key_id, product_id, key_value in (
+            _locked(ProductKey.objects.filter(reserved_order=order, is_sold=False).order_by("id"))
+            .values_list("id", "product_id", "key_value")
+        ):
+            held[product_id].append((key_id, key_value))
+        held_total = sum(len(keys) for keys in held.values())
+
+        items = list(order.items.select_related("product"))
+        claimed = {}
+        missing = defaultdict(int)
+        for item in items:
+            claimed[item.id] = held[item.product_id][:item.quantity]
+            del held[item.product_id][:item.quantity]
+            if len(claimed[item.id]) < item.quantity:
+                missing[item.product_id] += item.quantity - len(claimed[item.id])
+
+        free = _free_keys_by_product(missing) if missing else {}
+        deltas = {}
+        from_stock_ids = []
+        for item in items:
+            short = item.quantity - len(claimed[item.id])
+            if short:
+                extra = free.get(item.product_id, [])[:short]
+                if len(extra) < short:
+                    raise NotEnoughKeys(item.product, item.quantity, len(claimed[item.id]) + len(extra))
+                del free[item.product_id][:short]
+                from_stock_ids.extend(key_id for key_id, _ in extra)
+                claimed[item.id] = claimed[item.id] + extra
+
+            # зарезервированные ключи со склада уже списаны в hold_keys
+            stock, sold = deltas.get(item.product_id, (0, 0))
+            deltas[item.product_id] = (stock - short, sold + item.quantity)
+
+        key_ids = [key_id for keys in claimed.values() for key_id, _ in keys]
+        if key_ids:
+            # условие отсекает ключ, который успели продать или
+            # перезарезервировать параллельно: он не уйдёт дважды
+            updated = (
+                ProductKey.objects
+                .filter(Q(reserved_order=order, is_sold=False) | FREE_KEY, id__in=key_ids)
+                .update(
+                    is_sold=True,
+                    is_active=False,
+                    reserved_order=None,
+                    reserved_until=None,
+                    order_item=Case(
+                        *[
+                            When(id__in=[key_id for key_id, _ in keys], then=Value(item_id))
+                            for item_id, keys in claimed.items() if keys
+                        ],
+                        output_field=ProductKey._meta.get_field("order_item"),
+                    ),
+                )
+            )
+            if updated != len(key_ids):
+                # резерв сняли параллельно — пусть покупатель повторит оплату
+                chosen = Counter()
+                for item in items:
+                    chosen[item.product_id] += len(claimed[item.id])
+                raise _shortage(
+                    items, chosen, ProductKey.objects.filter(id__in=key_ids, order_item__order=order)
+                )
+
+        # bulk update не вызывает сигналы ProductKey — двигаем счётчики сами
+        adjust_counters_bulk(deltas)
+
+        # остаток резерва, не попавший в позиции, — обратно на склад
+        if held_total > len(key_ids) - len(from_stock_ids):
+            release_order_holds([order])
+
+    return [
+        (item.product, key_value)
+        for item in items
+        for _, key_value in claimed[item.id]
+    ]
+
+
+# ---------- ИМПОРТ КЛЮЧЕЙ ----------
+KEY_MAX_LENGTH = ProductKey._meta.get_field("key_value").max_length
+
+
+def iter_key_lines(stream, is_csv=False):
+    """
+    Построчно читать ключи из текстового потока, не загружая файл целиком.
+
+    В CSV ключом считается первая колонка.
+    """
+    if is_csv:
+        for row in csv.reader(stream):
+            if row:
+                yield row[0].strip()
+    else:
+        for line in stream:
+            yield line.strip()
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.elapsed = 0.0
+
+    @property
+    def keys_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return self.created / self.elapsed
+
+    def __str__(self):
+        return (
+            f"Добавлено: {self.created}, дубликатов: {self.duplicates}, "
+            f"некорректных строк: {self.invalid}, "
+            f"{self.keys_per_second:.0f} ключей/с"
+        )
+
+
+def import_keys(product, key_values, batch_size=2000):
+    """
+    Массово загрузить ключи товара.
+
+    Ключи идут пачками: дубликаты внутри пачки и уже существующие в БД
+    отсеиваются одним запросом по уникальному индексу key_value, остальное
+    сохраняется через bulk_create. Счётчики товара пересчитываются один раз
+    в конце — и тогда, когда чтение файла оборвалось ошибкой (например,
+    UnicodeDecodeError): уже сохранённые пачки остаются. Возвращает ImportResult.
+    """
+    result = ImportResult()
+    started = time.monotonic()
+
+    try:
+        _import_chunks(product, key_values, batch_size, result)
+    finally:
+        recalc_product_counters(product)
+
+    result.elapsed = time.monotonic() - started
+    return result
+
+
+def _import_chunks(product, key_values, batch_size, result):
+    with suppress_counter_signals():
+        for chunk in _chunks(key_values, batch_size):
+            batch = {}
+            for value in chunk:
+                if not value:
+                    continue
+                if len(value) > KEY_MAX_LENGTH:
+                    result.invalid += 1
+                elif value in batch:
+                    result.duplicates += 1
+                else:
+                    batch[value] = None
+
+            existing = set(
+                ProductKey.objects
+                .filter(key_value__in=batch)
+                .values_list("key_value", flat=True)
+            )
+            new_keys = [
+                ProductKey(product=product, key_value=value)
+                for value in batch
+                if value not in existing
+            ]
+
+            result.duplicates += len(existing)
+            if not new_keys:
+                continue
+
+            # ignore_conflicts — на случай, если ключ успели добавить параллельно;
+            # такие строки не вставляются, поэтому добавленные считаем запросом
+            ProductKey.objects.bulk_create(new_keys, ignore_conflicts=True)
+            inserted = ProductKey.objects.filter(
+                product=product, key_value__in=[key.key_value for key in new_keys]
+            ).count()
+
+            result.created += inserted
+            result.duplicates += len(new_keys) - inserted
@@ -0,0 +1,148 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _in_process_enabled():
+    return getattr(settings, "MAIL_QUEUE_IN_PROCESS", False)
+
+
+def enqueue_email(subject, body, to):
+    """
+    Поставить письмо в очередь: один INSERT, без похода в SMTP.
+
+    Отправляет воркер (manage.py run_mail_worker). При MAIL_QUEUE_IN_PROCESS
+    (удобно в разработке) очередь разбирается фоновым потоком этого же
+    процесса сразу после коммита транзакции.
+    """
+    email = OutboundEmail.objects.create(subject=subject, body=body, to=",".join(to))
+    if _in_process_enabled():
+        transaction.on_commit(_kick_in_process_worker)
+    return email
+
+
+def _kick_in_process_worker():
+    global _executor
+    if _executor is None:
+        # один поток: письма уходят по очереди через одно SMTP-соединение
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mail")
+    _executor.submit(_deliver_in_thread)
+
+
+def _deliver_in_thread():
+    try:
+        deliver_pending()
+    except Exception:
+        logger.exception("Ошибка фоновой отправки почты")
+    finally:
+        close_old_connections()
+
+
+def retry_delay(attempts):
+    """
+    Экспоненциальная пауза перед следующей попыткой: base, 2·base, 4·base...
+    """
+    base = getattr(settings, "MAIL_RETRY_BASE_SECONDS", 60)
+    cap = getattr(settings, "MAIL_RETRY_MAX_SECONDS", 6 * 60 * 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), cap))
+
+
+def _claim_batch(batch_size):
+    """
+    Забрать пачку писем, которым пора уходить, пометив их "отправляется".
+
+    Условный UPDATE по статусу не даст двум воркерам взять одно письмо;
+    next_attempt_at становится временем захвата (по нему release_stuck
+    находит письма упавшего воркера).
+    """
+    now = timezone.now()
+    due = (
+        OutboundEmail.objects
+        .filter(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+        .order_by("next_attempt_at", "id")
+    )
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list("id", flat=True)[:batch_size])
+        OutboundEmail.objects.filter(
+            id__in=ids, status=OutboundEmail.STATUS_PENDING
+        ).update(status=OutboundEmail.STATUS_SENDING, next_attempt_at=now)
+    return list(OutboundEmail.objects.filter(id__in=ids, status=OutboundEmail.STATUS_SENDING))
+
+
+def deliver_pending(batch_size=50):
+    """
+    Отправить одну пачку писем через одно SMTP-соединение.
+
+    Неудачные письма возвращаются в очередь с паузой по retry_delay,
+    после MAIL_MAX_ATTEMPTS попыток — статус "не отправлено".
+    Возвращает количество отправленных.
+    """
+    emails = _claim_batch(batch_size)
+    if not emails:
+        return 0
+
+    max_attempts = getattr(settings, "MAIL_MAX_ATTEMPTS", 5)
+    sent = 0
+
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+        for email in emails:
+            email.attempts += 1
+            try:
+                EmailMessage(
+                    email.subject, email.body, to=email.recipients, connection=mail_connection
+                ).send()
+            except Exception as exc:
+                email.last_error = str(exc)
+                if email.attempts >= max_attempts:
+                    email.status = OutboundEmail.STATUS_FAILED
+                else:
+                    email.status = OutboundEmail.STATUS_PENDING
+                    email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+                logger.warning("Письмо #%s не отправлено: %s", email.pk, exc)
+            else:
+                email.status = OutboundEmail.STATUS_SENT
+                email.sent_at = timezone.now()
+                email.last_error = ""
+                sent += 1
+    except Exception as exc:
+        # не удалось даже открыть соединение — вся пачка ждёт следующей попытки
+        for email in emails:
+            if email.status == OutboundEmail.STATUS_SENDING:
+                email.status = OutboundEmail.STATUS_PENDING
+                email.last_error = str(exc)
+                email.next_attempt_at = timezone.now() + retry_delay(max(email.attempts, 1))
+        logger.warning("SMTP недоступен: %s", exc)
+    finally:
+        mail_connection.close()
+        OutboundEmail.objects.bulk_update(
+            emails,
+            ["status", "attempts", "next_attempt_at", "last_error", "sent_at"],
+        )
+
+    return sent
+
+
+def release_stuck(older_than=timedelta(minutes=10)):
+    """
+    Вернуть в очередь письма, зависшие в "отправляется" (воркер упал).
+    """
+    return (
+        OutboundEmail.objects
+        .filter(status=OutboundEmail.STATUS_SENDING, next_attempt_at__lte=timezone.now() - older_than)
+        .update(status=OutboundEmail.STATUS_PENDING)
+    )
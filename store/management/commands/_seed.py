@@ -0,0 +1,71 @@
+"""
+Синтетическая витрина для замеров (manage.py bench, manage.py loadtest).
+
+Модуль с подчёркиванием — Django не считает его командой.
+"""
+from django.contrib.auth.hashers import make_password
+
+from store.models import (
+    Category,
+    CustomUser,
+    Product,
+    ProductKey,
+    reconcile_all_counters,
+    suppress_counter_signals,
+)
+
+
+class SeededData:
+    def __init__(self, category_slugs, product_ids, product_slugs, users):
+        self.category_slugs = category_slugs
+        self.product_ids = product_ids
+        self.product_slugs = product_slugs
+        self.users = users
+
+
+def seed_storefront(rnd, categories, products, keys, users):
+    """
+    Заполнить текущую БД bulk-вставками: категории, товары, по keys ключей
+    на товар и пользователи с одинаковым паролем "bench-password".
+    """
+    created_categories = Category.objects.bulk_create([
+        Category(name=f"Категория {i}", slug=f"category-{i}")
+        for i in range(categories)
+    ])
+
+    Product.objects.bulk_create([
+        Product(
+            product_code=f"BENCH-{i}",
+            category=rnd.choice(created_categories),
+            name=f"Товар {i}",
+            slug=f"product-{i}",
+            description="Синтетический товар для замеров. " * 10,
+            price=rnd.randint(100, 10000),
+        )
+        for i in range(products)
+    ], batch_size=1000)
+    product_ids = list(Product.objects.values_list("id", flat=True))
+
+    with suppress_counter_signals():
+        batch = []
+        for product_id in product_ids:
+            for j in range(keys):
+                batch.append(ProductKey(product_id=product_id, key_value=f"{product_id}-{j}"))
+            if len(batch) >= 5000:
+                ProductKey.objects.bulk_create(batch)
+                batch = []
+        ProductKey.objects.bulk_create(batch)
+    reconcile_all_counters()
+
+    password = make_password("bench-password")
+    CustomUser.objects.bulk_create([
+        CustomUser(username=f"bench{i}", email=f"bench{i}@example.com", password=password)
+        for i in range(users)
+    ])
+
+    return SeededData(
+        category_slugs=[category.slug for category in created_categories],
+        product_ids=product_ids,
+        product_slugs=list(Product.objects.values_list("slug", flat=True)),
+        users=list(CustomUser.objects.all()),
+    )
@@ -0,0 +1,228 @@
+import itertools
+import json
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from ._seed import seed_storefront
+
+CATALOG_SORTS = [None, "price_asc", "price_desc", "new"]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер горячих путей витрины на синтетических данных во временной БД: "
+        "p50/p95 времени и число SQL-запросов, результат — JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=10)
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--keys", type=int, default=20, help="Ключей на товар")
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=30, help="Повторов на сценарий")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Куда записать JSON (по умолчанию — только таблица)")
+        parser.add_argument("--compare", help="JSON прошлого прогона для сравнения p50")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.repeat = options["repeat"]
+
+        # всё происходит во временной тестовой БД — рабочая база не трогается
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed(options)
+            results = self.run_scenarios()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "commit": self.git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "database": connection.vendor,
+            "params": {
+                name: options[name]
+                for name in ("categories", "products", "keys", "users", "repeat", "seed")
+            },
+            "results": results,
+        }
+
+        self.print_table(results)
+        if options["compare"]:
+            self.print_comparison(results, options["compare"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fh:
+                json.dump(report, fh, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результат записан в {options['output']}"))
+
+        failed = [row["name"] for row in results if "error" in row]
+        if failed:
+            raise CommandError(f"Сценарии с ошибками: {', '.join(failed)}")
+
+    # ---------- ДАННЫЕ ----------
+    def seed(self, options):
+        started = time.perf_counter()
+        data = seed_storefront(
+            self.random,
+            categories=options["categories"],
+            products=options["products"],
+            keys=options["keys"],
+            users=options["users"],
+        )
+        self.product_ids = data.product_ids
+        self.product_slugs = data.product_slugs
+        self.users = data.users
+        self.category_slug = data.category_slugs[0] if data.category_slugs else None
+        self.stdout.write(f"Данные созданы за {time.perf_counter() - started:.1f} с")
+
+    # ---------- СЦЕНАРИИ ----------
+    def measure(self, name, request_factory):
+        """
+        Замерить сценарий. Если он падает, в отчёт попадает ошибка,
+        а остальные сценарии всё равно выполняются.
+        """
+        timings = []
+        queries = []
+        statuses = set()
+
+        try:
+            for _ in range(self.repeat):
+                client, method, url, data = request_factory()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url, data or {})
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries.append(len(captured))
+                statuses.add(response.status_code)
+        except Exception as exc:
+            return {"name": name, "error": f"{type(exc).__name__}: {exc}"}
+
+        return {
+            "name": name,
+            "p50_ms": round(percentile(timings, 0.5), 3),
+            "p95_ms": round(percentile(timings, 0.95), 3),
+            "queries_p50": percentile(queries, 0.5),
+            "queries_max": max(queries),
+            "statuses": sorted(statuses),
+        }
+
+    def logged_in_client(self):
+        client = Client()
+        client.force_login(self.random.choice(self.users))
+        return client
+
+    def fill_cart(self, client, lines=3):
+        # через cart_add — работает при любом CART_STORAGE
+        for product_id in self.random.sample(self.product_ids, min(lines, len(self.product_ids))):
+            client.get(reverse("cart_add", args=[product_id]))
+
+    def run_scenarios(self):
+        anonymous = Client()
+        results = [
+            self.measure("home", lambda: (anonymous, "get", reverse("index"), None)),
+        ]
+
+        price_filters = [
+            {},
+            {"min_price": 1000},
+            {"max_price": 5000},
+            {"min_price": 1000, "max_price": 5000},
+        ]
+        for category, prices, sort in itertools.product(
+            [None, self.category_slug], price_filters, CATALOG_SORTS
+        ):
+            params = dict(prices)
+            if category:
+                params["category"] = category
+            if sort:
+                params["sort"] = sort
+            label = "&".join(f"{key}={value}" for key, value in sorted(params.items()))
+            results.append(self.measure(
+                f"catalog?{label}",
+                lambda params=params: (anonymous, "get", reverse("catalog"), params),
+            ))
+
+        results.append(self.measure(
+            "product_detail",
+            lambda: (anonymous, "get",
+                     reverse("product_detail", args=[self.random.choice(self.product_slugs)]), None),
+        ))
+
+        buyer = self.logged_in_client()
+        results.append(self.measure(
+            "cart_add",
+            lambda: (buyer, "get", reverse("cart_add", args=[self.random.choice(self.product_ids)]), None),
+        ))
+
+        def checkout_start():
+            client = self.logged_in_client()
+            self.fill_cart(client)
+            return client, "get", reverse("checkout_start"), None
+
+        results.append(self.measure("checkout_start", checkout_start))
+
+        def pay_order():
+            client = self.logged_in_client()
+            self.fill_cart(client)
+            order_url = client.get(reverse("checkout_start"))["Location"]
+            return client, "get", order_url, None
+
+        results.append(self.measure("pay_order", pay_order))
+        return results
+
+    # ---------- ВЫВОД ----------
+    def print_table(self, results):
+        width = max(len(row["name"]) for row in results)
+        self.stdout.write(f"{'сценарий':<{width}}  {'p50, мс':>9}  {'p95, мс':>9}  {'SQL':>5}")
+        for row in results:
+            if "error" in row:
+                self.stdout.write(self.style.ERROR(f"{row['name']:<{width}}  ошибка: {row['error']}"))
+                continue
+            self.stdout.write(
+                f"{row['name']:<{width}}  {row['p50_ms']:>9.2f}  {row['p95_ms']:>9.2f}  "
+                f"{row['queries_max']:>5}"
+            )
+
+    def print_comparison(self, results, path):
+        with open(path, encoding="utf-8") as fh:
+            previous = {row["name"]: row for row in json.load(fh)["results"]}
+
+        self.stdout.write(f"\nСравнение с {path}:")
+        for row in results:
+            before = previous.get(row["name"])
+            if not before or "error" in before or "error" in row:
+                continue
+            change = (row["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0
+            line = (
+                f"{row['name']}: p50 {before['p50_ms']:.2f} -> {row['p50_ms']:.2f} мс ({change:+.0f}%), "
+                f"SQL {before['queries_max']} -> {row['queries_max']}"
+            )
+            if change > 20 or row["queries_max"] > before["queries_max"]:
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
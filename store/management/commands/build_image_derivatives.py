@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.images import VARIANT_FIELDS, process, process_pending
+from store.models import CustomUser, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Построить WebP/AVIF-производные для картинок товаров и аватаров: "
+        "разовый проход по очереди или фоновый воркер (--watch)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--watch", action="store_true", help="Работать постоянно, опрашивая очередь")
+        parser.add_argument("--interval", type=float, default=5.0, help="Пауза при пустой очереди, секунд")
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--rebuild", action="store_true", help="Перестроить производные всех картинок")
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            self.rebuild()
+            return
+
+        while True:
+            done = process_pending(batch_size=options["batch_size"])
+            if done:
+                self.stdout.write(f"Обработано картинок: {done}")
+            if not options["watch"]:
+                if not done:
+                    break
+                continue
+            close_old_connections()
+            if not done:
+                time.sleep(options["interval"])
+
+    def rebuild(self):
+        done = 0
+        for model, field_name in ((Product, "image"), (CustomUser, "avatar")):
+            queryset = (
+                model.objects
+                .exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .only("pk", field_name, VARIANT_FIELDS[field_name])
+            )
+            for instance in queryset.iterator():
+                done += process(instance, field_name)
+        self.stdout.write(self.style.SUCCESS(f"Перестроено картинок: {done}"))
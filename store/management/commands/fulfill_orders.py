@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.payments import fulfill_paid_orders
+
+
+class Command(BaseCommand):
+    help = "Выдать ключи оплаченным заказам (после вебхука провайдера)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--watch", action="store_true", help="Разбирать очередь постоянно")
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--interval", type=float, default=2.0, help="Пауза при пустой очереди, секунд")
+
+    def handle(self, *args, **options):
+        while True:
+            done = fulfill_paid_orders(batch_size=options["batch_size"])
+            if done:
+                self.stdout.write(f"Выдано заказов: {done}")
+            if not options["watch"]:
+                break
+            close_old_connections()
+            if not done:
+                time.sleep(options["interval"])
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.keys import import_keys, iter_key_lines
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Загрузить ключи товара из TXT (ключ на строку) или CSV (ключ в первой колонке)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("sku", help="Код товара (product_code)")
+        parser.add_argument("file", help="Путь к .txt или .csv файлу")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--encoding", default="utf-8-sig",
+            help="Кодировка файла (по умолчанию UTF-8, например cp1251)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(product_code=options["sku"])
+        except Product.DoesNotExist:
+            raise CommandError(f"Товар с кодом {options['sku']} не найден")
+
+        path = options["file"]
+        is_csv = path.lower().endswith(".csv")
+
+        try:
+            with open(path, encoding=options["encoding"], newline="") as stream:
+                result = import_keys(
+                    product,
+                    iter_key_lines(stream, is_csv=is_csv),
+                    batch_size=options["batch_size"],
+                )
+        except (OSError, LookupError) as exc:
+            raise CommandError(f"Не удалось прочитать файл: {exc}")
+        except UnicodeDecodeError as exc:
+            raise CommandError(
+                f"Файл не в кодировке {options['encoding']} ({exc.reason}, байт {exc.start}); "
+                f"укажите --encoding. Пачки до ошибки уже загружены"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"{product}: {result}"))
@@ -0,0 +1,193 @@
+import asyncio
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from store.payments import fulfill_paid_orders
+
+from ._seed import seed_storefront
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон витрины во временной БД: запросов/с при высокой "
+        "конкурентности через WSGI-обработчик (потоки) и ASGI-обработчик (asyncio); "
+        "--scenario checkout — оформлений заказа в секунду для текущего DB_PROFILE"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=64)
+        parser.add_argument("--requests", type=int, default=2000, help="Запросов на режим")
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--scenario", choices=["browse", "checkout"], default="browse",
+            help="browse — чтение витрины, checkout — корзина, заказ и оплата",
+        )
+
+    def handle(self, *args, **options):
+        if options["scenario"] == "checkout":
+            return self.handle_checkout(options)
+
+        rnd = random.Random(options["seed"])
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            data = seed_storefront(rnd, categories=10, products=options["products"], keys=5, users=1)
+            urls = [
+                reverse("index"),
+                reverse("catalog"),
+                reverse("catalog") + "?sort=price_asc",
+                reverse("cart"),
+            ] + [reverse("product_detail", args=[slug]) for slug in data.product_slugs[:50]]
+            urls = self.renderable(urls)
+            if not urls:
+                raise CommandError("Ни одна страница витрины не отдаётся без ошибки")
+            plan = [rnd.choice(urls) for _ in range(options["requests"])]
+
+            wsgi = self.run_wsgi(plan, options["concurrency"])
+            asgi = asyncio.run(self.run_asgi(plan, options["concurrency"]))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"Конкурентность: {options['concurrency']}, запросов: {len(plan)}")
+        for name, (rps, errors) in (("WSGI", wsgi), ("ASGI", asgi)):
+            self.stdout.write(f"{name}: {rps:8.1f} запросов/с, ошибок: {errors}")
+
+    # ---------- ОФОРМЛЕНИЕ ЗАКАЗОВ ----------
+    def handle_checkout(self, options):
+        concurrency = options["concurrency"]
+        per_worker = max(1, options["requests"] // concurrency)
+        products = options["products"]
+        # каждый заказ забирает один ключ — с запасом, чтобы не кончились
+        keys = 2 * per_worker * concurrency // products + 5
+
+        # SQLite в памяти не показывает блокировки файла — берём временный файл
+        tmp_path = None
+        if connection.vendor == "sqlite":
+            fd, tmp_path = tempfile.mkstemp(suffix=".sqlite3")
+            os.close(fd)
+            connection.settings_dict["TEST"]["NAME"] = tmp_path
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            data = seed_storefront(
+                random.Random(options["seed"]),
+                categories=5, products=products, keys=keys, users=concurrency,
+            )
+            clients = []
+            for user in data.users:
+                client = Client()
+                client.force_login(user)
+                clients.append(client)
+            orders_per_second, errors = self.run_checkout(
+                clients, data.product_ids, per_worker, options["seed"]
+            )
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        profile = getattr(settings, "DB_PROFILE", connection.vendor)
+        self.stdout.write(
+            f"Профиль БД: {profile} ({connection.vendor}), конкурентность: {concurrency}, "
+            f"заказов: {per_worker * concurrency}"
+        )
+        self.stdout.write(f"Оформление: {orders_per_second:8.1f} заказов/с, ошибок: {errors}")
+
+    def run_checkout(self, clients, product_ids, per_worker, seed):
+        def worker(index):
+            client = clients[index]
+            rnd = random.Random(seed + index)
+            errors = 0
+            for _ in range(per_worker):
+                try:
+                    client.get(reverse("cart_add", args=[rnd.choice(product_ids)]))
+                    response = client.get(reverse("checkout_start"))
+                    if response.status_code != 302 or "/pay/" not in response["Location"]:
+                        errors += 1
+                        continue
+                    # оплата на странице заглушки и выдача ключей (в продакшене — fulfill_orders)
+                    response = client.get(response["Location"])
+                    if response.status_code != 302:
+                        errors += 1
+                        continue
+                    errors += client.post(response["Location"], {"pay": ""}).status_code != 302
+                    fulfill_paid_orders()
+                except Exception:
+                    # "database is locked" и подобное — считаем, а не падаем
+                    errors += 1
+            connections.close_all()
+            return errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            errors = sum(pool.map(worker, range(len(clients))))
+        completed = per_worker * len(clients) - errors
+        return completed / (time.perf_counter() - started), errors
+
+    # ---------- ЧТЕНИЕ ВИТРИНЫ ----------
+    def renderable(self, urls):
+        """
+        Страницы, которые отдаются без ошибки; остальные в прогон не попадают.
+        """
+        client = Client(raise_request_exception=False)
+        result = []
+        for url in urls:
+            status = client.get(url).status_code
+            if status < 400:
+                result.append(url)
+            else:
+                self.stderr.write(self.style.WARNING(f"{url}: ответ {status}, страница пропущена"))
+        return result
+
+    # raise_request_exception=False: исключение во вьюхе — ответ 500,
+    # он считается ошибкой, а не обрывает прогон
+    def run_wsgi(self, plan, concurrency):
+        def worker(urls):
+            client = Client(raise_request_exception=False)
+            errors = 0
+            for url in urls:
+                try:
+                    errors += client.get(url).status_code >= 400
+                except Exception:
+                    # "database is locked" и подобное — считаем, а не падаем
+                    errors += 1
+            connections.close_all()
+            return errors
+
+        chunks = [plan[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            errors = sum(pool.map(worker, chunks))
+        return len(plan) / (time.perf_counter() - started), errors
+
+    async def run_asgi(self, plan, concurrency):
+        async def worker(urls):
+            client = AsyncClient(raise_request_exception=False)
+            errors = 0
+            for url in urls:
+                try:
+                    errors += (await client.get(url)).status_code >= 400
+                except Exception:
+                    errors += 1
+            return errors
+
+        chunks = [plan[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        errors = sum(await asyncio.gather(*(worker(chunk) for chunk in chunks)))
+        return len(plan) / (time.perf_counter() - started), errors
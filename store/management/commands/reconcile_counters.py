@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.models import reconcile_all_counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитать stock / sold_count всех товаров по ключам одним сгруппированным запросом"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = reconcile_all_counters(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Исправлено товаров: {fixed}"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.keys import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Вернуть на склад ключи с истёкшим резервом неоплаченных заказов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--watch", action="store_true", help="Проверять резервы постоянно")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--interval", type=float, default=60.0, help="Пауза между проходами, секунд")
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds(batch_size=options["batch_size"])
+            if released:
+                self.stdout.write(f"Освобождено ключей: {released}")
+            if not options["watch"]:
+                break
+            close_old_connections()
+            time.sleep(options["interval"])
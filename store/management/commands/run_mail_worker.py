@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.mail import deliver_pending, release_stuck
+
+
+class Command(BaseCommand):
+    help = "Отправлять письма из очереди исходящей почты (OutboundEmail)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Разобрать очередь один раз и выйти")
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--interval", type=float, default=5.0, help="Пауза при пустой очереди, секунд")
+
+    def handle(self, *args, **options):
+        released = release_stuck()
+        if released:
+            self.stdout.write(f"Возвращено в очередь зависших писем: {released}")
+
+        while True:
+            sent = deliver_pending(batch_size=options["batch_size"])
+            if sent:
+                self.stdout.write(f"Отправлено писем: {sent}")
+            if options["once"]:
+                break
+            close_old_connections()
+            if not sent:
+                time.sleep(options["interval"])
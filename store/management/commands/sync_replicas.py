@@ -0,0 +1,33 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Скопировать основную SQLite-базу в файлы реплик (DB_REPLICAS) — "
+        "локальная имитация репликации для проверки роутера"
+    )
+
+    def handle(self, *args, **options):
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("Команда только для SQLite: реплики PostgreSQL настраиваются репликацией")
+        if not settings.REPLICA_DATABASES:
+            raise CommandError("Реплики не заданы: укажите DB_REPLICAS")
+
+        source = sqlite3.connect(settings.DATABASES["default"]["NAME"])
+        try:
+            for alias in settings.REPLICA_DATABASES:
+                connections[alias].close()
+                target = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+                try:
+                    # backup API даёт согласованный снимок и при открытой на запись базе
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f"{alias}: {settings.DATABASES[alias]['NAME']}")
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS("Реплики обновлены"))
@@ -0,0 +1,92 @@
+# Generated by Django 5.2 on 2026-10-17 00:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Файлы 0002–0006 в репозиторий не попали. Эта миграция сводит их в одну:
+# от состояния 0001_initial до схемы, на которую опирается 0007. Имя совпадает
+# с последней из них — в базах, где 0002–0006 уже применены, она считается
+# выполненной, на новой базе создаёт недостающее.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productkey',
+            options={},
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='email_verified',
+            field=models.BooleanField(default=False, verbose_name='Почта подтверждена'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='pending_email',
+            field=models.EmailField(blank=True, max_length=254, null=True, verbose_name='Новая почта (ожидает подтверждения)'),
+        ),
+        migrations.AddField(
+            model_name='productkey',
+            name='is_sold',
+            field=models.BooleanField(default=False, verbose_name='Продан'),
+        ),
+        migrations.AlterField(
+            model_name='customuser',
+            name='city',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='Город'),
+        ),
+        migrations.AlterField(
+            model_name='customuser',
+            name='phone',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Телефон'),
+        ),
+        migrations.AlterField(
+            model_name='productkey',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='productkey',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Активен'),
+        ),
+        migrations.AlterField(
+            model_name='productkey',
+            name='key_value',
+            field=models.CharField(max_length=255, unique=True, verbose_name='Ключ'),
+        ),
+        migrations.AlterField(
+            model_name='productkey',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='keys', to='store.product'),
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Сумма заказа')),
+                ('status', models.CharField(choices=[('new', 'Новый'), ('paid', 'Оплачен'), ('canceled', 'Отменён')], default='new', max_length=20, verbose_name='Статус')),
+                ('provider', models.CharField(blank=True, max_length=50, verbose_name='Платёжный провайдер')),
+                ('provider_payment_id', models.CharField(blank=True, max_length=100, verbose_name='ID платежа у провайдера')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='store.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='store.product')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_customuser_email_verified'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['category', 'price', 'id'], name='product_catalog_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['category', '-created_at', '-id'], name='product_catalog_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['-created_at', '-id'], name='product_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['-sold_count', '-created_at'], name='product_bestseller_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productkey',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['product', 'id'], name='productkey_free_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productkey',
+            index=models.Index(fields=['product', 'is_sold'], name='productkey_sold_idx'),
+        ),
+    ]
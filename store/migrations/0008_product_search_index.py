@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# Полнотекстовый поиск по товарам зависит от СУБД:
+# SQLite — виртуальная таблица FTS5 (синхронизируется сигналами Product),
+# PostgreSQL — GIN-индекс по взвешенному tsvector с русской морфологией.
+# Выражение индекса должно совпадать с store.search.PG_VECTOR.
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts "
+    "USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO store_product_fts(rowid, name, description) "
+    "SELECT id, name, description FROM store_product",
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS store_product_fts"]
+
+POSTGRES_CREATE = [
+    "CREATE INDEX IF NOT EXISTS product_search_gin ON store_product USING GIN (("
+    "setweight(to_tsvector('russian'::regconfig, coalesce(name, '')), 'A')"
+    " || setweight(to_tsvector('russian'::regconfig, coalesce(description, '')), 'B')"
+    "))",
+]
+POSTGRES_DROP = ["DROP INDEX IF EXISTS product_search_gin"]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_product_productkey_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE}),
+            _run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}),
+        ),
+    ]
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_productsalesstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productkey',
+            name='reserved_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='held_keys', to='store.order', verbose_name='Резерв под заказ'),
+        ),
+        migrations.AddField(
+            model_name='productkey',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Резерв до'),
+        ),
+        migrations.RemoveIndex(
+            model_name='productkey',
+            name='productkey_free_idx',
+        ),
+        migrations.AddIndex(
+            model_name='productkey',
+            index=models.Index(condition=models.Q(('is_sold', False), ('reserved_order__isnull', True)), fields=['product', 'id'], name='productkey_free_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productkey',
+            index=models.Index(condition=models.Q(('reserved_order__isnull', False)), fields=['reserved_until'], name='productkey_hold_idx'),
+        ),
+    ]
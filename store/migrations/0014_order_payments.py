@@ -0,0 +1,42 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_paid_orders_fulfilled(apps, schema_editor):
+    # заказы, оплаченные до вебхуков, ключи уже получили — в очередь выдачи их не ставим
+    Order = apps.get_model('store', 'Order')
+    Order.objects.filter(status='paid').update(paid_at=F('created_at'), fulfilled_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_order_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Оплачен'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='fulfilled_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Ключи выданы'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='fulfillment_error',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Ошибка выдачи'),
+        ),
+        migrations.RunPython(mark_paid_orders_fulfilled, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('provider_payment_id', ''), _negated=True), fields=('provider', 'provider_payment_id'), name='order_provider_payment_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('fulfilled_at__isnull', True), ('fulfillment_error', ''), ('status', 'paid')), fields=['paid_at'], name='order_fulfillment_idx'),
+        ),
+    ]
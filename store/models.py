@@ -2,6 +2,7 @@ from django.db import models
 from django.utils.text import slugify
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.utils import timezone
 
 # ---------- ГОРОДА ----------
 class City(models.Model):
@@ -64,6 +65,7 @@ class Product(models.Model):
     slug = models.SlugField(max_length=180, unique=True, blank=True)
     description = models.TextField(blank=True, verbose_name="Описание")
     image = models.ImageField(upload_to="products/", blank=True, null=True, verbose_name="Изображение")
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Производные изображения")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
     stock = models.PositiveIntegerField(default=0, verbose_name="Количество на складе")
     is_available = models.BooleanField(default=True, verbose_name="Доступен для покупки")
@@ -75,6 +77,38 @@ class Product(models.Model):
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ["-created_at"]
+        indexes = [
+            # Все индексы частичные (WHERE is_available): витрина читает только
+            # доступные товары, а условие is_available=True SQLite и PostgreSQL
+            # сопоставляют с условием индекса. id в конце — для курсора каталога.
+            models.Index(
+                fields=["category", "price", "id"],
+                condition=models.Q(is_available=True),
+                name="product_catalog_price_idx",
+            ),
+            models.Index(
+                fields=["category", "-created_at", "-id"],
+                condition=models.Q(is_available=True),
+                name="product_catalog_new_idx",
+            ),
+            # каталог без фильтра по категории
+            models.Index(
+                fields=["price", "id"],
+                condition=models.Q(is_available=True),
+                name="product_price_idx",
+            ),
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_available=True),
+                name="product_new_idx",
+            ),
+            # главная: популярные товары
+            models.Index(
+                fields=["-sold_count", "-created_at"],
+                condition=models.Q(is_available=True),
+                name="product_bestseller_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.product_code})"
@@ -85,15 +119,19 @@ class Product(models.Model):
         super().save(*args, **kwargs)
 
     def available_keys_count(self):
-        # Кол-во НЕпроданных ключей
-        return self.keys.filter(is_sold=False).count()
+        # Кол-во НЕпроданных и не зарезервированных ключей
+        return self.keys.filter(FREE_KEY).count()
 
     def get_free_key(self):
         # Берём первый свободный ключ
-        return self.keys.filter(is_sold=False).first()
+        return self.keys.filter(FREE_KEY).first()
 
 
 # ---------- КЛЮЧИ / АККАУНТЫ ----------
+# Свободный ключ: не продан и не зарезервирован под неоплаченный заказ
+FREE_KEY = models.Q(is_sold=False, reserved_order__isnull=True)
+
+
 class ProductKey(models.Model):
     product = models.ForeignKey(
         Product,
@@ -105,9 +143,59 @@ class ProductKey(models.Model):
     is_sold = models.BooleanField("Продан", default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # резерв между checkout_start и pay_order (store.keys.hold_keys)
+    reserved_order = models.ForeignKey(
+        "Order",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="held_keys",
+        verbose_name="Резерв под заказ",
+    )
+    reserved_until = models.DateTimeField("Резерв до", null=True, blank=True)
+
+    # позиция заказа, по которой ключ продан (store.keys.allocate_keys)
+    order_item = models.ForeignKey(
+        "OrderItem",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="keys",
+        verbose_name="Позиция заказа",
+    )
+
+    class Meta:
+        indexes = [
+            # свободные ключи товара: get_free_key / available_keys_count / hold_keys
+            models.Index(
+                fields=["product", "id"],
+                condition=FREE_KEY,
+                name="productkey_free_idx",
+            ),
+            # просроченные резервы для release_expired_holds
+            models.Index(
+                fields=["reserved_until"],
+                condition=models.Q(reserved_order__isnull=False),
+                name="productkey_hold_idx",
+            ),
+            # сгруппированные подсчёты stock / sold_count по товарам
+            models.Index(fields=["product", "is_sold"], name="productkey_sold_idx"),
+        ]
+
+    # is_sold на момент загрузки из БД — по нему сигналы видят переход
+    # "свободен -> продан" и двигают счётчики товара на дельту
+    _loaded_is_sold = None
+
     def __str__(self):
         return f"{self.product.name} — {self.key_value}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "is_sold" in field_names:
+            instance._loaded_is_sold = instance.is_sold
+        return instance
+
 
     def deactivate(self):
         self.is_active = False
@@ -136,6 +224,12 @@ class CustomUser(AbstractUser):
         null=True,
         verbose_name="Аватар"
     )
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Производные аватара"
+    )
 
     # --- новые поля ---
     email_verified = models.BooleanField(
@@ -195,6 +289,31 @@ class Order(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
 
+    # оплата подтверждается вебхуком провайдера, ключи выдаются в фоне (store.payments)
+    paid_at = models.DateTimeField(null=True, blank=True, verbose_name="Оплачен")
+    fulfilled_at = models.DateTimeField(null=True, blank=True, verbose_name="Ключи выданы")
+    fulfillment_error = models.CharField(max_length=255, blank=True, verbose_name="Ошибка выдачи")
+
+    class Meta:
+        constraints = [
+            # повторная доставка вебхука находит заказ по этому индексу
+            models.UniqueConstraint(
+                fields=["provider", "provider_payment_id"],
+                condition=~models.Q(provider_payment_id=""),
+                name="order_provider_payment_uniq",
+            ),
+        ]
+        indexes = [
+            # история заказов: keyset по (created_at, id) от новых к старым
+            models.Index(fields=["user", "-created_at", "-id"], name="order_user_created_idx"),
+            # очередь выдачи ключей: оплачен, но ещё не выдан
+            models.Index(
+                fields=["paid_at"],
+                condition=models.Q(status="paid", fulfilled_at__isnull=True, fulfillment_error=""),
+                name="order_fulfillment_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"Заказ #{self.id} от {self.user}"
 
@@ -209,27 +328,294 @@ class OrderItem(models.Model):
         return self.price * self.quantity
 
 
+# ---------- СТАТИСТИКА ПРОДАЖ ----------
+class ProductSalesStats(models.Model):
+    """
+    Продажи товара за один день. Пополняется при оплате заказа
+    (store.stats.record_order_sales), хранится STATS_RETENTION_DAYS дней.
+    """
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="sales_stats", verbose_name="Товар")
+    # копия product.category_id — топ по категории без JOIN с товарами
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+", verbose_name="Категория")
+    day = models.DateField(verbose_name="День")
+    quantity = models.PositiveIntegerField(default=0, verbose_name="Продано, шт.")
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Выручка")
+
+    class Meta:
+        verbose_name = "Продажи за день"
+        verbose_name_plural = "Статистика продаж"
+        constraints = [
+            models.UniqueConstraint(fields=["product", "day"], name="salesstats_product_day_uniq"),
+        ]
+        indexes = [
+            # топ за период по всему магазину и по категории
+            models.Index(fields=["day", "product"], name="salesstats_day_idx"),
+            models.Index(fields=["category", "day"], name="salesstats_category_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} за {self.day}: {self.quantity}"
+
+
+# ---------- ИСХОДЯЩАЯ ПОЧТА ----------
+class OutboundEmail(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "В очереди"),
+        (STATUS_SENDING, "Отправляется"),
+        (STATUS_SENT, "Отправлено"),
+        (STATUS_FAILED, "Не отправлено"),
+    )
+
+    to = models.TextField("Получатели", help_text="Адреса через запятую")
+    subject = models.CharField("Тема", max_length=255)
+    body = models.TextField("Текст")
+    status = models.CharField(
+        "Статус",
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    attempts = models.PositiveIntegerField("Попыток", default=0)
+    next_attempt_at = models.DateTimeField("Следующая попытка", default=timezone.now)
+    last_error = models.TextField("Последняя ошибка", blank=True)
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+    sent_at = models.DateTimeField("Отправлено", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Письмо"
+        verbose_name_plural = "Исходящая почта"
+        ordering = ["-created_at"]
+        indexes = [
+            # воркер выбирает письма, которым пора уходить
+            models.Index(fields=["status", "next_attempt_at"], name="outboundemail_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} → {self.to}"
+
+    @property
+    def recipients(self):
+        return [address.strip() for address in self.to.split(",") if address.strip()]
+
+
+import contextvars
+from contextlib import contextmanager
+
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.functions import Greatest
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from . import cache as store_cache
+
+
+# ---------- СЧЁТЧИКИ СКЛАДА / ПРОДАЖ ----------
+_counters_suppressed = contextvars.ContextVar("counters_suppressed", default=False)
+
+
+@contextmanager
+def suppress_counter_signals():
+    """
+    Отключить обновление счётчиков из сигналов ProductKey.
+
+    Для массовых операций (импорт, bulk-действия в админке): внутри блока
+    сигналы ничего не делают, а счётчики пересчитываются один раз в конце.
+    """
+    token = _counters_suppressed.set(True)
+    try:
+        yield
+    finally:
+        _counters_suppressed.reset(token)
+
+
+def adjust_product_counters(product_id, stock=0, sold=0):
+    """
+    Сдвинуть stock / sold_count товара на дельту одним UPDATE через F().
+    """
+    if not stock and not sold:
+        return
+    Product.objects.filter(pk=product_id).update(
+        stock=Greatest(F("stock") + stock, 0),
+        sold_count=Greatest(F("sold_count") + sold, 0),
+        updated_at=timezone.now(),
+    )
+    store_cache.bump_version(store_cache.PRODUCTS)
+
+
+def adjust_counters_bulk(deltas):
+    """
+    То же, что adjust_product_counters, но для многих товаров одним UPDATE.
+
+    deltas — {product_id: (дельта stock, дельта sold_count)}.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+
+    def shift(index):
+        return Case(
+            *[When(pk=pk, then=Value(delta[index])) for pk, delta in deltas.items()],
+            default=Value(0),
+        )
+
+    Product.objects.filter(pk__in=deltas).update(
+        stock=Greatest(F("stock") + shift(0), 0),
+        sold_count=Greatest(F("sold_count") + shift(1), 0),
+        updated_at=timezone.now(),
+    )
+    store_cache.bump_version(store_cache.PRODUCTS)
+
 
 def recalc_product_counters(product):
     """
     Пересчитать склад и проданные для товара по его ключам.
     """
-    stock = product.keys.filter(is_sold=False).count()
-    sold = product.keys.filter(is_sold=True).count()
+    counts = product.keys.aggregate(
+        stock=Count("id", filter=FREE_KEY),
+        sold=Count("id", filter=Q(is_sold=True)),
+    )
+
+    product.stock = counts["stock"]
+    product.sold_count = counts["sold"]
+    product.save(update_fields=["stock", "sold_count", "updated_at"])
+    store_cache.bump_version(store_cache.PRODUCTS)
+
+
+def reconcile_all_counters(batch_size=1000, product_ids=None):
+    """
+    Починить расхождения счётчиков у всех товаров (или только у product_ids).
 
-    product.stock = stock
-    product.sold_count = sold
-    product.save(update_fields=["stock", "sold_count"])
+    Реальные значения берутся одним сгруппированным запросом по ключам,
+    сохраняются только товары, у которых счётчики разошлись.
+    Возвращает количество исправленных товаров.
+    """
+    keys = ProductKey.objects.order_by()
+    products = Product.objects.only("id", "stock", "sold_count", "updated_at")
+    if product_ids is not None:
+        keys = keys.filter(product_id__in=list(product_ids))
+        products = products.filter(pk__in=list(product_ids))
+
+    actual = {
+        row["product_id"]: (row["stock"], row["sold"])
+        for row in keys.values("product_id").annotate(
+            stock=Count("id", filter=FREE_KEY),
+            sold=Count("id", filter=Q(is_sold=True)),
+        )
+    }
+
+    drifted = []
+    now = timezone.now()
+    for product in products.iterator(chunk_size=batch_size):
+        stock, sold = actual.get(product.id, (0, 0))
+        if product.stock != stock or product.sold_count != sold:
+            product.stock = stock
+            product.sold_count = sold
+            # bulk_update не трогает auto_now, а по updated_at строится ETag страницы товара
+            product.updated_at = now
+            drifted.append(product)
+
+    Product.objects.bulk_update(drifted, ["stock", "sold_count", "updated_at"], batch_size=batch_size)
+    if drifted:
+        store_cache.bump_version(store_cache.PRODUCTS)
+    return len(drifted)
 
 
 @receiver(post_save, sender=ProductKey)
-def product_key_saved(sender, instance, **kwargs):
-    recalc_product_counters(instance.product)
+def product_key_saved(sender, instance, created, raw=False, **kwargs):
+    was_sold = instance._loaded_is_sold
+    instance._loaded_is_sold = instance.is_sold
+
+    if raw or _counters_suppressed.get():
+        return
+
+    if created:
+        if instance.is_sold:
+            adjust_product_counters(instance.product_id, sold=1)
+        else:
+            adjust_product_counters(instance.product_id, stock=1)
+    elif was_sold is None or (was_sold != instance.is_sold and instance.reserved_order_id):
+        # ключ загружен без поля is_sold или продан в обход резерва — переход не известен
+        recalc_product_counters(instance.product)
+    elif was_sold != instance.is_sold:
+        if instance.is_sold:
+            adjust_product_counters(instance.product_id, stock=-1, sold=1)
+        else:
+            adjust_product_counters(instance.product_id, stock=1, sold=-1)
 
 
 @receiver(post_delete, sender=ProductKey)
 def product_key_deleted(sender, instance, **kwargs):
-    recalc_product_counters(instance.product)
+    if _counters_suppressed.get():
+        return
+
+    was_sold = instance._loaded_is_sold
+    if was_sold is None:
+        was_sold = instance.is_sold
+
+    if was_sold:
+        adjust_product_counters(instance.product_id, sold=-1)
+    elif instance.reserved_order_id is None:
+        # зарезервированный ключ в stock уже не учтён
+        adjust_product_counters(instance.product_id, stock=-1)
+
+
+# ---------- ИНВАЛИДАЦИЯ КЭША ----------
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    store_cache.bump_version(store_cache.PRODUCTS)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    store_cache.bump_version(store_cache.CATEGORIES)
+    # в карточках товаров выводится категория
+    store_cache.bump_version(store_cache.PRODUCTS)
+
+
+# ---------- ПОИСКОВЫЙ ИНДЕКС ----------
+@receiver(post_save, sender=Product)
+def product_search_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    from .search import index_product
+
+    if raw:
+        return
+    # сохранение одних счётчиков текст товара не меняет
+    if update_fields and not {"name", "description"} & set(update_fields):
+        return
+    index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_search_deleted(sender, instance, **kwargs):
+    from .search import unindex_product
+
+    unindex_product(instance.pk)
+
+
+# ---------- ПРОИЗВОДНЫЕ ИЗОБРАЖЕНИЯ ----------
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    from .images import is_stale, schedule
+
+    if raw or (update_fields and "image" not in update_fields):
+        return
+    if is_stale(instance, "image"):
+        schedule(instance, "image")
+
+
+@receiver(post_save, sender=CustomUser)
+def avatar_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    from .images import is_stale, schedule
+
+    if raw or (update_fields and "avatar" not in update_fields):
+        return
+    if is_stale(instance, "avatar"):
+        schedule(instance, "avatar")
@@ -0,0 +1,116 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([str(value), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, field):
+    """
+    Разобрать курсор в (значение поля сортировки, pk).
+
+    Испорченный или чужой курсор — None, то есть первая страница.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        return field.to_python(value), int(pk)
+    except (binascii.Error, ValueError, TypeError, ValidationError):
+        return None
+
+
+def clamp_page_size(value, default, maximum):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def _seek(queryset, order_field, cursor):
+    descending = order_field.startswith("-")
+    name = order_field.lstrip("-")
+    field = queryset.model._meta.get_field(name)
+    pk_name = queryset.model._meta.pk.attname
+
+    if descending:
+        queryset = queryset.order_by(f"-{name}", f"-{pk_name}")
+    else:
+        queryset = queryset.order_by(name, pk_name)
+
+    position = decode_cursor(cursor, field) if cursor else None
+    if position is not None:
+        value, pk = position
+        op = "lt" if descending else "gt"
+        queryset = queryset.filter(
+            Q(**{f"{name}__{op}": value})
+            | Q(**{name: value, f"{pk_name}__{op}": pk})
+        )
+    return queryset, field
+
+
+def _value(item, name):
+    # строки values() — словари, а не объекты модели
+    if isinstance(item, dict):
+        return item[name]
+    return getattr(item, name)
+
+
+def _make_page(items, field, page_size, wrap=None):
+    # берём на одну строку больше — так узнаём, есть ли следующая страница
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(
+            _value(last, field.attname), _value(last, field.model._meta.pk.attname)
+        )
+    if wrap is not None:
+        items = [wrap(item) for item in items]
+    return KeysetPage(items, next_cursor)
+
+
+def keyset_paginate(queryset, order_field, cursor=None, page_size=24, wrap=None):
+    """
+    Страница queryset по курсору (keyset / seek-пагинация).
+
+    order_field — поле сортировки, например "price" или "-created_at";
+    вторым ключом всегда идёт pk в ту же сторону, чтобы порядок был строгим.
+    Вместо OFFSET следующая страница ищется условием "после последней
+    строки", поэтому глубокие страницы стоят столько же, сколько первая.
+    queryset может быть values() с полем сортировки и pk; wrap — во что
+    превратить строки страницы (например, в ProductCard).
+    """
+    queryset, field = _seek(queryset, order_field, cursor)
+    return _make_page(list(queryset[:page_size + 1]), field, page_size, wrap)
+
+
+async def akeyset_paginate(queryset, order_field, cursor=None, page_size=24, wrap=None):
+    """
+    keyset_paginate для асинхронных вьюх (async ORM).
+    """
+    queryset, field = _seek(queryset, order_field, cursor)
+    items = [item async for item in queryset[:page_size + 1].aiterator()]
+    return _make_page(items, field, page_size, wrap)
@@ -0,0 +1,288 @@
+"""
+Оплата заказов через платёжного провайдера.
+
+pay_order создаёт платёж у провайдера и отправляет покупателя на его
+страницу оплаты. Результат приходит вебхуком (payment_webhook): он
+проверяет подпись и одним условным UPDATE по уникальному индексу
+(provider, provider_payment_id) переводит заказ в «оплачен». Повторная
+доставка того же уведомления обновляет ноль строк и ничего не делает.
+
+Ключи выдаются не в запросе вебхука: оплаченные заказы разбирает
+manage.py fulfill_orders, а при PAYMENTS_FULFILL_IN_PROCESS (разработка)
+— фоновый поток процесса после коммита.
+
+StubProvider — локальная заглушка: «страница оплаты» на нашем же сайте
+с кнопками «Оплатить» / «Отменить», уведомление подписывается HMAC так
+же, как это делал бы настоящий провайдер. Она включена только при DEBUG
+или явном PAYMENT_PROVIDER=stub (stub_enabled).
+"""
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .keys import NotEnoughKeys, allocate_keys, release_order_holds
+from .models import Order
+from .stats import record_order_sales
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+SUCCEEDED = "succeeded"
+CANCELED = "canceled"
+
+PAID_AFTER_CANCEL = "Оплата пришла после отмены заказа: вернуть деньги или выдать ключи вручную"
+
+
+class PaymentError(Exception):
+    """
+    Уведомление провайдера не прошло проверку (подпись, формат).
+    """
+
+
+class Notification:
+    def __init__(self, payment_id, status):
+        self.payment_id = payment_id
+        self.status = status
+
+
+# ---------- ПРОВАЙДЕРЫ ----------
+class PaymentProvider:
+    name = None
+
+    def create_payment(self, order):
+        """
+        Создать платёж у провайдера и вернуть его id.
+        """
+        raise NotImplementedError
+
+    def checkout_url(self, payment_id):
+        """
+        Куда отправить покупателя оплачивать.
+        """
+        raise NotImplementedError
+
+    def parse_notification(self, body, headers):
+        """
+        Проверить вебхук и вернуть Notification; иначе PaymentError.
+        """
+        raise NotImplementedError
+
+
+class StubProvider(PaymentProvider):
+    name = "stub"
+    SIGNATURE_HEADER = "X-Stub-Signature"
+
+    def _secret(self):
+        secret = getattr(settings, "PAYMENT_STUB_SECRET", "") or settings.SECRET_KEY
+        return secret.encode()
+
+    def sign(self, body):
+        return hmac.new(self._secret(), body, hashlib.sha256).hexdigest()
+
+    def create_payment(self, order):
+        return f"stub_{secrets.token_hex(12)}"
+
+    def checkout_url(self, payment_id):
+        return reverse("payment_stub", args=[payment_id])
+
+    def build_notification(self, payment_id, status):
+        """
+        Тело и заголовки вебхука — так, как их отправил бы провайдер.
+        """
+        body = json.dumps({"payment_id": payment_id, "status": status}).encode()
+        return body, {self.SIGNATURE_HEADER: self.sign(body)}
+
+    def parse_notification(self, body, headers):
+        if not hmac.compare_digest(self.sign(body), headers.get(self.SIGNATURE_HEADER, "")):
+            raise PaymentError("Неверная подпись уведомления")
+        try:
+            data = json.loads(body)
+            return Notification(str(data["payment_id"]), data["status"])
+        except (ValueError, KeyError, TypeError):
+            raise PaymentError("Некорректное тело уведомления")
+
+
+PAYMENT_PROVIDERS = {
+    "stub": StubProvider,
+}
+
+
+def stub_enabled():
+    """
+    Заглушка доступна в разработке или если её явно выбрали в PAYMENT_PROVIDER.
+    """
+    return settings.DEBUG or settings.PAYMENT_PROVIDER == StubProvider.name
+
+
+def enabled_providers():
+    return {
+        name: provider_class
+        for name, provider_class in PAYMENT_PROVIDERS.items()
+        if provider_class is not StubProvider or stub_enabled()
+    }
+
+
+def get_provider(name=None):
+    """
+    Провайдер по имени; неизвестное имя (например, заказы старого
+    демо-режима) — провайдер по умолчанию из PAYMENT_PROVIDER.
+    """
+    providers = enabled_providers()
+    provider_class = providers.get(name) or providers.get(settings.PAYMENT_PROVIDER)
+    if provider_class is None:
+        raise ImproperlyConfigured(
+            f"PAYMENT_PROVIDER={settings.PAYMENT_PROVIDER!r}: провайдер оплаты не настроен"
+        )
+    return provider_class()
+
+
+# ---------- ПЛАТЁЖ ----------
+def start_payment(order):
+    """
+    Создать платёж для заказа (один раз) и вернуть адрес страницы оплаты.
+    """
+    provider = get_provider(order.provider)
+    if order.provider_payment_id and order.provider == provider.name:
+        return provider.checkout_url(order.provider_payment_id)
+
+    payment_id = provider.create_payment(order)
+    # условный UPDATE: двойной клик не создаст заказу второй платёж
+    updated = (
+        Order.objects
+        .filter(id=order.id, status=Order.STATUS_NEW, provider_payment_id=order.provider_payment_id)
+        .update(provider=provider.name, provider_payment_id=payment_id)
+    )
+    if not updated:
+        order.refresh_from_db(fields=["provider", "provider_payment_id"])
+        return provider.checkout_url(order.provider_payment_id)
+
+    order.provider, order.provider_payment_id = provider.name, payment_id
+    return provider.checkout_url(payment_id)
+
+
+def process_notification(provider, notification):
+    """
+    Применить уведомление провайдера. Возвращает True, если заказ изменился,
+    False — если это повтор, и None — если платёж не найден.
+
+    Заказ ищется по уникальному индексу (provider, provider_payment_id), смена
+    статуса — условный UPDATE: повтор вебхука обновляет ноль строк.
+
+    Оплата, пришедшая после отмены заказа, — не повтор: деньги списаны, а
+    резерв ключей уже снят. Заказ становится оплаченным с fulfillment_error
+    и в очередь выдачи не попадает — его разбирают вручную (выдать ключи
+    или вернуть деньги).
+    """
+    orders = Order.objects.filter(provider=provider.name, provider_payment_id=notification.payment_id)
+
+    if notification.status == SUCCEEDED:
+        updated = orders.filter(status=Order.STATUS_NEW).update(
+            status=Order.STATUS_PAID, paid_at=timezone.now()
+        )
+        if updated:
+            schedule_fulfillment()
+        else:
+            updated = orders.filter(status=Order.STATUS_CANCELED).update(
+                status=Order.STATUS_PAID, paid_at=timezone.now(), fulfillment_error=PAID_AFTER_CANCEL
+            )
+            if updated:
+                logger.warning(
+                    "Платёж %s %s пришёл после отмены заказа — нужен возврат или ручная выдача",
+                    provider.name, notification.payment_id,
+                )
+    elif notification.status == CANCELED:
+        with transaction.atomic():
+            updated = orders.filter(status=Order.STATUS_NEW).update(status=Order.STATUS_CANCELED)
+            if updated:
+                release_order_holds(orders)
+    else:
+        # промежуточные статусы провайдера нам не нужны
+        updated = 0
+
+    if updated:
+        return True
+    return False if orders.exists() else None
+
+
+# ---------- ВЫДАЧА КЛЮЧЕЙ ----------
+def pending_fulfillment():
+    """
+    Оплаченные заказы, которым ещё не выданы ключи (индекс order_fulfillment_idx).
+    """
+    return Order.objects.filter(
+        status=Order.STATUS_PAID, fulfilled_at__isnull=True, fulfillment_error=""
+    ).order_by("paid_at")
+
+
+def fulfill_order(order_id):
+    """
+    Выдать ключи одному оплаченному заказу. Возвращает True, если выдал.
+
+    Условный UPDATE fulfilled_at забирает заказ — второй воркер его не
+    возьмёт. Если ключей не хватает, выдача откатывается, заказ получает
+    fulfillment_error и выходит из очереди до ручного разбора, а его резерв
+    возвращается на склад — иначе release_expired_holds (он снимает только
+    резервы неоплаченных заказов) не освободил бы эти ключи никогда.
+    """
+    with transaction.atomic():
+        claimed = (
+            pending_fulfillment()
+            .filter(id=order_id)
+            .update(fulfilled_at=timezone.now())
+        )
+        if not claimed:
+            return False
+
+        order = Order.objects.get(id=order_id)
+        try:
+            with transaction.atomic():
+                allocate_keys(order)
+                record_order_sales(order)
+        except NotEnoughKeys as exc:
+            logger.warning("Заказ #%s: %s", order_id, exc)
+            Order.objects.filter(id=order_id).update(
+                fulfilled_at=None, fulfillment_error=str(exc)[:255]
+            )
+            release_order_holds([order])
+            return False
+    return True
+
+
+def fulfill_paid_orders(batch_size=20):
+    """
+    Разобрать одну пачку очереди выдачи. Возвращает число выданных заказов.
+    """
+    order_ids = list(pending_fulfillment().values_list("id", flat=True)[:batch_size])
+    return sum(fulfill_order(order_id) for order_id in order_ids)
+
+
+def schedule_fulfillment():
+    if getattr(settings, "PAYMENTS_FULFILL_IN_PROCESS", False):
+        transaction.on_commit(_submit)
+
+
+def _submit():
+    global _executor
+    if _executor is None:
+        # один поток: заказы выдаются по очереди, без борьбы за одни ключи
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fulfillment")
+    _executor.submit(_fulfill_in_thread)
+
+
+def _fulfill_in_thread():
+    try:
+        fulfill_paid_orders()
+    except Exception:
+        logger.exception("Ошибка фоновой выдачи ключей")
+    finally:
+        close_old_connections()
@@ -0,0 +1,131 @@
+import re
+
+from django.db import connection
+from django.db.models import Count, Max, Min
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+# SQLite: виртуальная таблица FTS5, rowid = id товара, синхронизируется сигналами.
+FTS_TABLE = "store_product_fts"
+
+# PostgreSQL: то же выражение покрыто GIN-индексом product_search_gin
+# (см. миграцию 0008), сам индекс обновляется базой без сигналов.
+PG_VECTOR = (
+    "(setweight(to_tsvector('russian'::regconfig, coalesce(\"store_product\".\"name\", '')), 'A')"
+    " || setweight(to_tsvector('russian'::regconfig, coalesce(\"store_product\".\"description\", '')), 'B'))"
+)
+PG_QUERY = "websearch_to_tsquery('russian'::regconfig, %s)"
+
+# Окончания для грубого стемминга на SQLite: у FTS5 нет русского стеммера,
+# поэтому отрезаем окончание и ищем по префиксу ("игры" -> "игр*")
+RU_ENDINGS = sorted(
+    [
+        "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их",
+        "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ов", "ев",
+        "ам", "ям", "ах", "ях", "ом", "ем", "ую", "юю", "а", "я", "о", "е", "ы",
+        "и", "у", "ю", "ь", "й",
+    ],
+    key=len,
+    reverse=True,
+)
+MIN_STEM = 3
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def stem(word):
+    word = word.lower()
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def fts_query(text):
+    """
+    Строка пользователя -> запрос FTS5: все слова, каждое как префикс основы.
+
+    Слова берутся в кавычки, поэтому спецсинтаксис FTS5 из ввода не проходит.
+    """
+    terms = [f'"{stem(word)}"*' for word in WORD_RE.findall(text)]
+    return " AND ".join(terms)
+
+
+def matching_products(text):
+    """
+    Доступные товары, подходящие под запрос (без сортировки по релевантности).
+    """
+    products = Product.objects.filter(is_available=True)
+
+    if connection.vendor == "postgresql":
+        return products.filter(id__in=RawSQL(
+            f'SELECT "id" FROM "store_product" WHERE {PG_VECTOR} @@ {PG_QUERY}', [text]
+        ))
+
+    match = fts_query(text)
+    if not match:
+        return products.none()
+
+    return products.filter(id__in=RawSQL(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]
+    ))
+
+
+def rank_products(products, text):
+    """
+    Отсортировать найденные товары по релевантности, лучшие — первыми.
+
+    SQLite — BM25 из FTS5 (название весит в 10 раз больше описания),
+    PostgreSQL — ts_rank_cd по взвешенному tsvector (A — название, B — описание).
+    """
+    if connection.vendor == "postgresql":
+        return (
+            products
+            .annotate(rank=RawSQL(f"ts_rank_cd({PG_VECTOR}, {PG_QUERY})", [text]))
+            .order_by("-rank", "id")
+        )
+
+    # bm25 возвращает отрицательные числа: чем меньше, тем релевантнее
+    return (
+        products
+        .annotate(rank=RawSQL(
+            f"(SELECT bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = \"store_product\".\"id\")",
+            [fts_query(text)],
+        ))
+        .order_by("rank", "id")
+    )
+
+
+def search_facets(products):
+    """
+    Фасеты по найденным товарам: категории с количеством и диапазон цен.
+    """
+    categories = list(
+        products
+        .order_by()
+        .values("category__slug", "category__name")
+        .annotate(count=Count("id"))
+        .order_by("category__name")
+    )
+    prices = products.order_by().aggregate(min_price=Min("price"), max_price=Max("price"))
+    return {"categories": categories, **prices}
+
+
+# ---------- СИНХРОНИЗАЦИЯ FTS5 (только SQLite) ----------
+def index_product(product):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {FTS_TABLE}(rowid, name, description) VALUES (%s, %s, %s)",
+            [product.pk, product.name, product.description],
+        )
+
+
+def unindex_product(product_id):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
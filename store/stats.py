@@ -0,0 +1,164 @@
+"""
+Статистика продаж по дням (ProductSalesStats).
+
+Выдача ключей оплаченному заказу добавляет его позиции в строки дня
+оплаты тремя запросами на весь заказ, сколько бы позиций в нём ни было.
+«Топ за неделю» и топ категории читаются по индексу на (day) /
+(category, day): просматриваются только строки окна, а не вся таблица
+товаров.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from .cards import ProductCard, card_values
+from .models import Order, OrderItem, Product, ProductSalesStats
+
+
+def retention_days():
+    return getattr(settings, "STATS_RETENTION_DAYS", 90)
+
+
+def record_order_sales(order, day=None):
+    """
+    Добавить позиции оплаченного заказа в статистику за день оплаты.
+
+    Сначала строки дня создаются с нулями (ignore_conflicts — параллельная
+    оплата не упадёт на уникальности), потом все увеличиваются одним UPDATE.
+    """
+    day = day or timezone.localdate(order.paid_at or timezone.now())
+    sales = defaultdict(lambda: [0, Decimal("0")])
+    categories = {}
+    items = OrderItem.objects.filter(order=order).values_list(
+        "product_id", "product__category_id", "quantity", "price"
+    )
+    for product_id, category_id, quantity, price in items:
+        sales[product_id][0] += quantity
+        sales[product_id][1] += price * quantity
+        categories[product_id] = category_id
+
+    if not sales:
+        return
+
+    with transaction.atomic(savepoint=False):
+        ProductSalesStats.objects.bulk_create(
+            [
+                ProductSalesStats(product_id=product_id, category_id=categories[product_id], day=day)
+                for product_id in sales
+            ],
+            ignore_conflicts=True,
+        )
+        ProductSalesStats.objects.filter(day=day, product_id__in=list(sales)).update(
+            quantity=F("quantity") + Case(
+                *[When(product_id=pid, then=Value(qty)) for pid, (qty, _) in sales.items()],
+                default=Value(0),
+            ),
+            revenue=F("revenue") + Case(
+                *[When(product_id=pid, then=Value(rev)) for pid, (_, rev) in sales.items()],
+                default=Value(Decimal("0")),
+                output_field=ProductSalesStats._meta.get_field("revenue"),
+            ),
+        )
+
+
+def _ranking(days, category, limit):
+    since = timezone.localdate() - timedelta(days=days - 1)
+    stats = ProductSalesStats.objects.filter(day__gte=since)
+    if category is not None:
+        stats = stats.filter(category=category)
+    return (
+        stats
+        .filter(product__is_available=True)
+        .values("product_id")
+        .annotate(sold=Sum("quantity"))
+        .order_by("-sold", "product_id")
+        .values_list("product_id", flat=True)[:limit]
+    )
+
+
+def _in_ranking_order(ranking, rows):
+    cards = {row["id"]: ProductCard(row) for row in rows}
+    return [cards[product_id] for product_id in ranking if product_id in cards]
+
+
+def top_products(days=7, category=None, limit=6):
+    """
+    Карточки (ProductCard) самых продаваемых доступных товаров за последние days дней.
+    """
+    ranking = list(_ranking(days, category, limit))
+    rows = card_values(Product.objects.filter(pk__in=ranking))
+    return _in_ranking_order(ranking, rows)
+
+
+async def atop_products(days=7, category=None, limit=6):
+    """
+    top_products для асинхронных вьюх.
+    """
+    ranking = [product_id async for product_id in _ranking(days, category, limit)]
+    rows = [row async for row in card_values(Product.objects.filter(pk__in=ranking)).aiterator()]
+    return _in_ranking_order(ranking, rows)
+
+
+def prune_sales_stats(keep_days=None):
+    """
+    Удалить дни старше окна хранения.
+    """
+    keep_days = keep_days or retention_days()
+    cutoff = timezone.localdate() - timedelta(days=keep_days)
+    deleted, _ = ProductSalesStats.objects.filter(day__lt=cutoff).delete()
+    return deleted
+
+
+def rebuild_sales_stats(days=None, chunk_size=2000, batch_size=1000):
+    """
+    Пересобрать статистику за последние days дней по истории заказов.
+
+    Позиции оплаченных заказов с выданными ключами (как и в
+    record_order_sales) читаются потоком (iterator с chunk_size), в памяти —
+    только суммы по (товар, день). Днём продажи считается день оплаты
+    (paid_at): заказ, созданный вчера и оплаченный сегодня, — сегодняшняя
+    продажа. Возвращает количество записанных строк.
+    """
+    days = days or retention_days()
+    since = timezone.localdate() - timedelta(days=days - 1)
+    current_tz = timezone.get_current_timezone()
+
+    totals = defaultdict(lambda: [0, Decimal("0")])
+    categories = {}
+    items = (
+        OrderItem.objects
+        .filter(
+            order__status=Order.STATUS_PAID,
+            order__fulfilled_at__isnull=False,
+            order__paid_at__date__gte=since,
+        )
+        .values_list("product_id", "product__category_id", "order__paid_at", "quantity", "price")
+        .iterator(chunk_size=chunk_size)
+    )
+    for product_id, category_id, paid_at, quantity, price in items:
+        key = (product_id, timezone.localtime(paid_at, current_tz).date())
+        totals[key][0] += quantity
+        totals[key][1] += price * quantity
+        categories[product_id] = category_id
+
+    rows = [
+        ProductSalesStats(
+            product_id=product_id,
+            category_id=categories[product_id],
+            day=day,
+            quantity=quantity,
+            revenue=revenue,
+        )
+        for (product_id, day), (quantity, revenue) in totals.items()
+    ]
+
+    with transaction.atomic():
+        ProductSalesStats.objects.filter(day__gte=since).delete()
+        ProductSalesStats.objects.bulk_create(rows, batch_size=batch_size)
+    prune_sales_stats()
+    return len(rows)
@@ -0,0 +1,28 @@
+from django import template
+
+from store.images import srcset
+
+register = template.Library()
+
+
+@register.inclusion_tag("store/partials/picture.html")
+def picture(image, variants, alt="", sizes="100vw", css_class="", element_id=""):
+    """
+    <picture> с источниками AVIF/WebP из производных и запасным <img>.
+
+    image — поле картинки или готовый URL (ProductCard.image_url).
+    Пока производные не построены, выводится просто оригинал.
+    """
+    variants = variants or {}
+    return {
+        "src": getattr(image, "url", image),
+        "sources": [
+            (f"image/{fmt}", srcset(variants, fmt))
+            for fmt in ("avif", "webp")
+            if variants.get(fmt)
+        ],
+        "alt": alt,
+        "sizes": sizes,
+        "css_class": css_class,
+        "element_id": element_id,
+    }
@@ -0,0 +1,22 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def css_bundle(name):
+    """
+    <link> на собранный набор CSS из STATIC_BUNDLES.
+
+    В DEBUG набора ещё нет (его делает collectstatic) — выводятся ссылки
+    на исходные файлы по отдельности.
+    """
+    sources = settings.STATIC_BUNDLES[name]
+    if settings.DEBUG:
+        return format_html_join(
+            "\n", '<link rel="stylesheet" href="{}">', ((static(source),) for source in sources)
+        )
+    return format_html('<link rel="stylesheet" href="{}">', static(name))
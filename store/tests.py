@@ -1,3 +1,1412 @@
-from django.test import TestCase
+import base64
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from smtplib import SMTPException
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from PIL import Image
+
+from digitalnexus.db_router import ReplicaPinMiddleware, ReplicaRouter, pin_to_primary
+from digitalnexus.staticfiles import StaticFilesMiddleware, minify_css
+from digitalnexus.testing import QueryBudgetMixin
+
+from .cards import card_values, product_cards
+from .cart import CacheCartStorage, SignedCookieCartStorage
+from .images import process_pending, variant_files
+from .mail import deliver_pending, enqueue_email, release_stuck, retry_delay
+from .pagination import encode_cursor, keyset_paginate
+from . import keys as keys_module
+from .keys import (
+    KEY_MAX_LENGTH,
+    NotEnoughKeys,
+    allocate_keys,
+    hold_keys,
+    import_keys,
+    release_expired_holds,
+)
+from .payments import PAID_AFTER_CANCEL, StubProvider, fulfill_order, fulfill_paid_orders, get_provider, stub_enabled
+from .models import (
+    FREE_KEY,
+    Category,
+    CustomUser,
+    Order,
+    OrderItem,
+    OutboundEmail,
+    Product,
+    ProductKey,
+    ProductSalesStats,
+    recalc_product_counters,
+    reconcile_all_counters,
+)
+from .stats import rebuild_sales_stats, record_order_sales
+
+
+class HotQueryIndexTests(TestCase):
+    """
+    Горячие запросы витрины должны идти по индексам, а не полным сканом.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Игры")
+        for i in range(20):
+            product = Product.objects.create(
+                product_code=f"SKU-{i}",
+                category=cls.category,
+                name=f"Игра {i}",
+                slug=f"game-{i}",
+                price=100 + i,
+            )
+            ProductKey.objects.create(product=product, key_value=f"KEY-{i}")
+        cls.product = product
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            # на маленькой таблице планировщик иначе выберет Seq Scan
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f"Индекс {index_name} не используется:\n{plan}")
+
+    def test_catalog_category_price_filter(self):
+        qs = (
+            Product.objects
+            .filter(is_available=True, category__slug=self.category.slug, price__gte=105, price__lte=115)
+            .order_by("price", "id")
+        )
+        self.assertUsesIndex(qs, "product_catalog_price_idx")
+
+    def test_catalog_sorted_by_price(self):
+        qs = Product.objects.filter(is_available=True).order_by("-price", "-id")
+        self.assertUsesIndex(qs, "product_price_idx")
+
+    def test_catalog_sorted_by_new(self):
+        qs = Product.objects.filter(is_available=True).order_by("-created_at", "-id")
+        self.assertUsesIndex(qs, "product_new_idx")
+
+    def test_catalog_category_sorted_by_new(self):
+        qs = Product.objects.filter(is_available=True, category=self.category).order_by("-created_at", "-id")
+        self.assertUsesIndex(qs, "product_catalog_new_idx")
+
+    def test_home_bestsellers(self):
+        qs = Product.objects.filter(is_available=True).order_by("-sold_count", "-created_at")[:6]
+        self.assertUsesIndex(qs, "product_bestseller_idx")
+
+    def test_free_keys_of_product(self):
+        qs = ProductKey.objects.filter(FREE_KEY, product=self.product).order_by("id")
+        self.assertUsesIndex(qs, "productkey_free_idx")
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Пагинация по курсору: одинаковые значения сортировки не теряются и не
+    повторяются, испорченный курсор — первая страница.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        for i in range(7):
+            Product.objects.create(
+                product_code=f"SKU-{i}", category=category, name=f"Игра {i}", slug=f"game-{i}",
+                # у пяти товаров одна цена — страницы режут группу одинаковых
+                price=100 if i < 5 else 50 + i,
+            )
+        Product.objects.update(created_at=timezone.now())
+
+    def walk(self, order_field, page_size=2):
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(Product.objects.all(), order_field, cursor=cursor, page_size=page_size)
+            seen.extend(product.pk for product in page)
+            cursor = page.next_cursor
+            if cursor is None:
+                return seen
+
+    def test_ties_are_split_by_pk(self):
+        for order_field in ("price", "-price", "-created_at"):
+            with self.subTest(order_field=order_field):
+                expected = list(
+                    Product.objects.order_by(order_field, "-pk" if order_field.startswith("-") else "pk")
+                    .values_list("pk", flat=True)
+                )
+                self.assertEqual(self.walk(order_field), expected)
+
+    def test_tampered_cursor_gives_first_page(self):
+        first = [product.pk for product in keyset_paginate(Product.objects.all(), "price", page_size=3)]
+        for cursor in (
+            "garbage!",
+            encode_cursor("дорого", 1),
+            base64.urlsafe_b64encode(b'{"price": 1}').decode(),
+            base64.urlsafe_b64encode(b'["100", "pk"]').decode(),
+        ):
+            with self.subTest(cursor=cursor):
+                page = keyset_paginate(Product.objects.all(), "price", cursor=cursor, page_size=3)
+                self.assertEqual([product.pk for product in page], first)
+
+        response = self.client.get(reverse("catalog"), {"cursor": "garbage!", "sort": "price_asc"})
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(TestCase):
+    """
+    Полнотекстовый поиск: релевантность, словоформы, синхронизация индекса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.in_name = Product.objects.create(
+            product_code="SKU-N", category=category, name="Космическая стратегия", slug="space",
+            price=500, description="Пошаговая игра",
+        )
+        cls.in_description = Product.objects.create(
+            product_code="SKU-D", category=category, name="Гонки", slug="racing",
+            price=100, description="Аркада с космическими трассами",
+        )
+
+    def found(self, query, **params):
+        response = self.client.get(reverse("search"), {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [card.slug for card in response.context["products"]]
+
+    def test_name_ranks_above_description(self):
+        self.assertEqual(self.found("космическая"), ["space", "racing"])
+
+    def test_word_forms(self):
+        self.assertEqual(self.found("стратегии"), ["space"])
+        self.assertEqual(self.found("игры"), ["space"])
+
+    def test_index_follows_save_and_delete(self):
+        self.in_description.name = "Гонки на выживание"
+        self.in_description.save()
+        self.assertEqual(self.found("выживание"), ["racing"])
+
+        self.in_description.delete()
+        self.assertEqual(self.found("космическая"), ["space"])
+
+    def test_bad_price_ignored(self):
+        self.assertEqual(self.found("космическая", min_price="дорого", max_price="NaN"), ["space", "racing"])
+        self.assertEqual(self.found("космическая", min_price="200"), ["space"])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.found('"космическая* ^('), ["space", "racing"])
+        # слова OR/NEAR — обычные слова запроса, а не операторы
+        self.assertEqual(self.found("космическая OR гонки"), [])
+
+
+@override_settings(CART_STORAGE="cookie")
+class ViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Вьюхи витрины не должны выходить за объявленный query_budget.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Игры", slug="games")
+        cls.products = []
+        for i in range(5):
+            product = Product.objects.create(
+                product_code=f"SKU-{i}",
+                category=cls.category,
+                name=f"Игра {i}",
+                slug=f"game-{i}",
+                description="Ключ активации игры",
+                price=100 + i,
+            )
+            for j in range(3):
+                ProductKey.objects.create(product=product, key_value=f"KEY-{i}-{j}")
+            cls.products.append(product)
+        cls.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def fill_cart(self):
+        self.client.cookies[settings.CART_COOKIE_NAME] = SignedCookieCartStorage.encode(
+            {str(product.id): 2 for product in self.products}
+        )
+
+    def test_home(self):
+        self.assertWithinQueryBudget(reverse("index"))
+
+    def test_catalog(self):
+        self.assertWithinQueryBudget(reverse("catalog"))
+        self.assertWithinQueryBudget(
+            reverse("catalog"),
+            data={"category": "games", "min_price": 101, "sort": "price_desc"},
+        )
+
+    def test_search(self):
+        self.assertWithinQueryBudget(reverse("search"), data={"q": "игра"})
+
+    def test_product_detail(self):
+        self.assertWithinQueryBudget(reverse("product_detail", args=["game-0"]))
+
+    def test_cart(self):
+        self.fill_cart()
+        self.assertWithinQueryBudget(reverse("cart"))
+        self.assertWithinQueryBudget(reverse("cart_add", args=[self.products[0].id]))
+        self.assertWithinQueryBudget(reverse("cart_remove", args=[self.products[0].id]))
+
+    def test_checkout(self):
+        self.fill_cart()
+        response = self.assertWithinQueryBudget(reverse("checkout_start"))
+        self.assertWithinQueryBudget(response["Location"])
+
+    def test_listings_render_product_cards(self):
+        cache.clear()
+        for url in (reverse("index"), reverse("catalog")):
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, "Игра 0")
+            product_queries = [q["sql"] for q in queries.captured_queries if '"store_product"' in q["sql"]]
+            self.assertTrue(product_queries)
+            self.assertFalse(any('"description"' in sql for sql in product_queries))
+
+    def test_catalog_facets(self):
+        cache.clear()
+        response = self.client.get(reverse("catalog"), {"max_price": 102})
+        self.assertEqual(response.context["category_facets"], [(self.category, 3)])
+        self.assertEqual(response.context["price_bounds"], (100, 104))
+        self.assertEqual(response.context["price_histogram"][0]["count"], 5)
+
+        # фасеты того же фильтра — из кэша, без запроса
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("catalog"), {"max_price": 102, "sort": "new"})
+        self.assertFalse(any('"bucket"' in q["sql"] for q in queries.captured_queries))
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_server_timing_and_metrics(self):
+        response = self.client.get(reverse("index"))
+        self.assertIn("db;dur=", response["Server-Timing"])
+
+        metrics = self.client.get(reverse("metrics"), headers={"authorization": "Bearer secret"})
+        metrics = metrics.content.decode()
+        self.assertIn('digitalnexus_requests_total{view="index"}', metrics)
+        # время шаблонов считает бэкенд InstrumentedDjangoTemplates
+        self.assertNotIn('digitalnexus_template_seconds_total{view="index"} 0.000000', metrics)
+
+    @override_settings(METRICS_TOKEN="secret", METRICS_ALLOWED_IPS=["10.0.0.0/8"])
+    def test_metrics_not_public(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={"authorization": "Bearer wrong"}).status_code, 403)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="10.1.2.3").status_code, 200)
+
+        self.client.force_login(CustomUser.objects.create_user("staff", "staff@example.com", "password", is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ConditionalGetTests(TestCase):
+    """
+    Каталог и страница товара отвечают 304, пока данные не менялись.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Игры", slug="games")
+        cls.product = Product.objects.create(
+            product_code="SKU-1",
+            category=cls.category,
+            name="Игра",
+            slug="game",
+            price=100,
+        )
+        cls.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def assertNotModified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        again = self.client.get(url, headers={"if-none-match": response["ETag"]})
+        self.assertEqual(again.status_code, 304)
+        return response
+
+    def test_catalog_and_product(self):
+        for url in (reverse("catalog"), reverse("product_detail", args=["game"])):
+            with self.subTest(url=url):
+                response = self.assertNotModified(url)
+                self.assertIn("public", response["Cache-Control"])
+                # одно время изменения не покрывает страницу — только ETag
+                self.assertFalse(response.has_header("Last-Modified"))
+
+    def test_product_change_invalidates(self):
+        url = reverse("product_detail", args=["game"])
+        etag = self.client.get(url)["ETag"]
+
+        self.product.price = 200
+        self.product.save()
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_deleted_product_not_hidden_by_if_modified_since(self):
+        Product.objects.create(
+            product_code="SKU-2", category=self.category, name="Вторая", slug="second", price=50
+        )
+        # удаляется не самый свежий товар: max(updated_at) каталога не меняется
+        Product.objects.filter(id=self.product.id).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        url = reverse("catalog")
+        self.client.get(url)
+        self.product.delete()
+
+        response = self.client.get(url, headers={"if-modified-since": http_date(time.time() + 60)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([card.slug for card in response.context["products"]], ["second"])
+
+    def test_authenticated_user_gets_private_etag(self):
+        url = reverse("catalog")
+        anonymous_etag = self.client.get(url)["ETag"]
+
+        self.client.force_login(self.user)
+        response = self.assertNotModified(url)
+        self.assertNotEqual(response["ETag"], anonymous_etag)
+        self.assertIn("private", response["Cache-Control"])
+        self.assertFalse(response.has_header("Last-Modified"))
+
+
+class CartStorageTests(TestCase):
+    """
+    Корзина в cookie или кэше не пишет в БД и переходит пользователю при входе.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.products = []
+        for i in range(2):
+            product = Product.objects.create(
+                product_code=f"SKU-{i}",
+                category=category,
+                name=f"Игра {i}",
+                slug=f"game-{i}",
+                price=100,
+            )
+            for j in range(3):
+                ProductKey.objects.create(product=product, key_value=f"KEY-{i}-{j}")
+            cls.products.append(product)
+        cls.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNoWrites(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        writes = [q["sql"] for q in queries.captured_queries if not q["sql"].lstrip().upper().startswith("SELECT")]
+        self.assertEqual(writes, [])
+
+    def test_mutations_do_not_write_to_database(self):
+        for storage in ("cookie", "cache"):
+            with self.subTest(storage=storage), self.settings(CART_STORAGE=storage):
+                self.client.cookies.clear()
+                self.assertNoWrites(reverse("cart_add", args=[self.products[0].id]))
+                self.assertNoWrites(reverse("cart_add", args=[self.products[0].id]))
+                self.assertNoWrites(reverse("cart_remove", args=[self.products[0].id]))
+
+    @override_settings(CART_STORAGE="cache")
+    def test_anonymous_cart_merged_on_login(self):
+        cache.set(CacheCartStorage.user_key(self.user.pk), {str(self.products[0].id): 1})
+        self.client.get(reverse("cart_add", args=[self.products[0].id]))
+        self.client.get(reverse("cart_add", args=[self.products[1].id]))
+
+        self.client.post(reverse("login"), {"username": "buyer", "password": "password"})
+
+        self.assertEqual(
+            cache.get(CacheCartStorage.user_key(self.user.pk)),
+            {str(self.products[0].id): 2, str(self.products[1].id): 1},
+        )
+
+
+def pay_through_stub(client, pay_url):
+    """
+    Оплатить заказ на странице заглушки и выдать ключи, как это сделал бы fulfill_orders.
+    """
+    stub_url = client.get(pay_url)["Location"]
+    response = client.post(stub_url, {"pay": ""})
+    fulfill_paid_orders()
+    return response
+
+
+class KeyAllocationTests(TestCase):
+    """
+    Выдача ключей: ни при повторе, ни при гонке один ключ не продаётся дважды.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.product = Product.objects.create(
+            product_code="SKU-0", category=category, name="Игра", slug="game", price=100
+        )
+        ProductKey.objects.bulk_create(
+            ProductKey(product=cls.product, key_value=f"KEY-{j}") for j in range(4)
+        )
+        recalc_product_counters(cls.product)
+        cls.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def new_order(self, quantity=2):
+        order = Order.objects.create(user=self.user, total_price=100 * quantity)
+        OrderItem.objects.create(order=order, product=self.product, price=100, quantity=quantity)
+        return order
+
+    def assertNoKeySoldTwice(self):
+        sold = ProductKey.objects.filter(is_sold=True)
+        self.assertFalse(sold.filter(order_item__isnull=True).exists())
+        self.assertEqual(
+            sum(item.keys.count() for item in OrderItem.objects.all()), sold.count()
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(
+            (self.product.stock, self.product.sold_count),
+            (ProductKey.objects.filter(FREE_KEY).count(), sold.count()),
+        )
+
+    def test_orders_get_distinct_keys(self):
+        first = {key for _, key in allocate_keys(self.new_order())}
+        second = {key for _, key in allocate_keys(self.new_order())}
+        self.assertEqual(len(first | second), 4)
+
+        with self.assertRaises(NotEnoughKeys), transaction.atomic():
+            allocate_keys(self.new_order(quantity=1))
+        self.assertNoKeySoldTwice()
+
+    def test_repeated_fulfillment_sells_once(self):
+        order = self.new_order()
+        Order.objects.filter(id=order.id).update(status=Order.STATUS_PAID, paid_at=timezone.now())
+
+        self.assertTrue(fulfill_order(order.id))
+        self.assertFalse(fulfill_order(order.id))
+        self.assertEqual(ProductKey.objects.filter(order_item__order=order).count(), 2)
+        self.assertNoKeySoldTwice()
+
+    def test_race_on_same_keys(self):
+        """
+        Второй заказ выбрал те же свободные ключи, но первый продал их раньше
+        UPDATE второго: условие FREE_KEY не даст продать их ещё раз.
+        """
+        first, second = self.new_order(), self.new_order()
+        real = keys_module._free_keys_by_product
+        raced = []
+
+        def racing(needed):
+            free = real(needed)
+            if not raced:
+                raced.append(None)
+                raced[0] = [key_value for _, key_value in allocate_keys(first)]
+            return free
+
+        with mock.patch.object(keys_module, "_free_keys_by_product", racing):
+            with self.assertRaises(NotEnoughKeys), transaction.atomic():
+                allocate_keys(second)
+
+        # первый успел взять ровно те ключи, что выбрал второй
+        self.assertEqual(raced[0], ["KEY-0", "KEY-1"])
+        self.assertNoKeySoldTwice()
+
+    def test_race_blames_short_product(self):
+        other = Product.objects.create(
+            product_code="SKU-1", category=self.product.category, name="Другая", slug="other", price=100
+        )
+        ProductKey.objects.create(product=other, key_value="OTHER-0")
+        order = self.new_order(quantity=1)
+        OrderItem.objects.create(order=order, product=other, price=100, quantity=1)
+        real = keys_module._free_keys_by_product
+
+        def racing(needed):
+            # ключ второго товара уходит другому покупателю до UPDATE
+            free = real(needed)
+            ProductKey.objects.filter(product=other).update(is_sold=True)
+            return free
+
+        for step in (hold_keys, allocate_keys):
+            with self.subTest(step=step.__name__):
+                with mock.patch.object(keys_module, "_free_keys_by_product", racing):
+                    with self.assertRaises(NotEnoughKeys) as caught, transaction.atomic():
+                        step(order)
+                self.assertEqual(caught.exception.product, other)
+                self.assertEqual((caught.exception.requested, caught.exception.available), (1, 0))
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+class ConcurrentHoldTests(TransactionTestCase):
+    """
+    Параллельные покупки: ключи, заблокированные чужой транзакцией,
+    пропускаются до лимита — второй покупатель получает следующие.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name="Игры", slug="games")
+        self.product = Product.objects.create(
+            product_code="SKU-0", category=category, name="Игра", slug="game", price=100
+        )
+        ProductKey.objects.bulk_create(
+            ProductKey(product=self.product, key_value=f"KEY-{j}") for j in range(4)
+        )
+        recalc_product_counters(self.product)
+        self.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def test_second_hold_skips_locked_keys(self):
+        locked, done = threading.Event(), threading.Event()
+        first = []
+
+        def first_checkout():
+            try:
+                with transaction.atomic():
+                    free = keys_module._free_keys_by_product({self.product.id: 2})
+                    first.extend(key_value for _, key_value in free[self.product.id])
+                    locked.set()
+                    done.wait(10)
+            finally:
+                locked.set()
+                connection.close()
+
+        thread = threading.Thread(target=first_checkout)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            order = Order.objects.create(user=self.user, total_price=200)
+            OrderItem.objects.create(order=order, product=self.product, price=100, quantity=2)
+            hold_keys(order)
+        finally:
+            done.set()
+            thread.join()
+
+        self.assertEqual(first, ["KEY-0", "KEY-1"])
+        self.assertEqual(
+            sorted(order.held_keys.values_list("key_value", flat=True)), ["KEY-2", "KEY-3"]
+        )
+
+
+class CounterTests(TestCase):
+    """
+    stock / sold_count следуют за ключами, reconcile_counters чинит расхождения.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.products = [
+            Product.objects.create(
+                product_code=f"SKU-{i}", category=category, name=f"Игра {i}", slug=f"game-{i}", price=100
+            )
+            for i in range(3)
+        ]
+        for product in cls.products[:2]:
+            for j in range(3):
+                ProductKey.objects.create(product=product, key_value=f"KEY-{product.pk}-{j}")
+
+    def counters(self):
+        return [
+            (product.stock, product.sold_count)
+            for product in Product.objects.filter(pk__in=[p.pk for p in self.products]).order_by("pk")
+        ]
+
+    def test_signals_follow_keys(self):
+        key = self.products[0].keys.first()
+        key.is_sold = True
+        key.save()
+        self.products[1].keys.first().delete()
+        self.assertEqual(self.counters(), [(2, 1), (2, 0), (0, 0)])
+
+    def test_reconcile_repairs_drift(self):
+        key = self.products[0].keys.first()
+        key.is_sold = True
+        key.save()
+        # UPDATE мимо сигналов — счётчики расходятся с ключами
+        Product.objects.filter(pk=self.products[0].pk).update(stock=99, sold_count=0)
+        Product.objects.filter(pk=self.products[2].pk).update(stock=5)
+        ProductKey.objects.filter(product=self.products[1]).update(is_sold=True)
+
+        out = io.StringIO()
+        call_command("reconcile_counters", batch_size=2, stdout=out)
+        self.assertIn("Исправлено товаров: 3", out.getvalue())
+        self.assertEqual(self.counters(), [(2, 1), (0, 3), (0, 0)])
+
+        self.assertEqual(reconcile_all_counters(), 0)
+
+    def test_reconcile_refreshes_product_page(self):
+        product = self.products[0]
+        url = reverse("product_detail", args=[product.slug])
+        etag = self.client.get(url)["ETag"]
+
+        ProductKey.objects.filter(product=product).update(is_sold=True)
+        self.assertEqual(reconcile_all_counters(), 1)
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["product"].stock, 0)
+
+
+@override_settings(CART_STORAGE="cookie")
+class KeyHoldTests(TestCase):
+    """
+    checkout_start резервирует ключи под заказ, склад учитывает резерв.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.product = Product.objects.create(
+            product_code="SKU-0",
+            category=category,
+            name="Игра",
+            slug="game",
+            price=100,
+        )
+        for j in range(3):
+            ProductKey.objects.create(product=cls.product, key_value=f"KEY-{j}")
+        cls.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.client.cookies[settings.CART_COOKIE_NAME] = SignedCookieCartStorage.encode(
+            {str(self.product.id): 2}
+        )
+
+    def assertCounters(self, stock, sold):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold_count), (stock, sold))
+        # счётчики совпадают с пересчётом по ключам
+        recalc_product_counters(self.product)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold_count), (stock, sold))
+
+    def test_checkout_holds_keys(self):
+        self.client.get(reverse("checkout_start"))
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.held_keys.count(), 2)
+        self.assertEqual(self.product.available_keys_count(), 1)
+        self.assertCounters(stock=1, sold=0)
+
+    def test_legacy_checkout_goes_through_order(self):
+        response = self.client.get(reverse("checkout"))
+        self.assertRedirects(response, reverse("checkout_start"), fetch_redirect_response=False)
+        self.assertFalse(ProductKey.objects.filter(is_active=False).exists())
+        self.assertCounters(stock=3, sold=0)
+
+    def test_new_checkout_replaces_abandoned_order(self):
+        self.client.get(reverse("checkout_start"))
+        self.client.get(reverse("checkout_start"))
+        self.assertEqual(ProductKey.objects.filter(reserved_order__isnull=False).count(), 2)
+        self.assertCounters(stock=1, sold=0)
+
+    def test_new_checkout_keeps_order_in_payment(self):
+        response = self.client.get(reverse("checkout_start"))
+        self.client.get(response["Location"])
+        order = Order.objects.get(user=self.user)
+        self.assertNotEqual(order.provider_payment_id, "")
+
+        self.client.cookies[settings.CART_COOKIE_NAME] = SignedCookieCartStorage.encode(
+            {str(self.product.id): 1}
+        )
+        self.client.get(reverse("checkout_start"))
+        self.assertEqual(order.held_keys.count(), 2)
+        self.assertCounters(stock=0, sold=0)
+
+    def test_expired_holds_released(self):
+        self.client.get(reverse("checkout_start"))
+        ProductKey.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(release_expired_holds(), 2)
+        self.assertCounters(stock=3, sold=0)
+
+    def test_pay_sells_held_keys(self):
+        response = self.client.get(reverse("checkout_start"))
+        order = Order.objects.get(user=self.user)
+        held = set(order.held_keys.values_list("key_value", flat=True))
+
+        pay_through_stub(self.client, response["Location"])
+        sold = set(ProductKey.objects.filter(order_item__order=order).values_list("key_value", flat=True))
+        self.assertEqual(sold, held)
+        self.assertFalse(ProductKey.objects.filter(reserved_order__isnull=False).exists())
+        self.assertCounters(stock=1, sold=2)
+
+    def test_pay_after_expiry_takes_free_keys(self):
+        response = self.client.get(reverse("checkout_start"))
+        ProductKey.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        release_expired_holds()
+
+        pay_through_stub(self.client, response["Location"])
+        self.assertCounters(stock=1, sold=2)
+
+    def test_paid_order_keeps_hold_until_fulfilled(self):
+        response = self.client.get(reverse("checkout_start"))
+        stub_url = self.client.get(response["Location"])["Location"]
+        self.client.post(stub_url, {"pay": ""})
+        ProductKey.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(release_expired_holds(), 0)
+        self.assertCounters(stock=1, sold=0)
+
+
+    def test_many_line_cart_constant_queries(self):
+        category = Category.objects.get(slug="games")
+        products = []
+        for i in range(30):
+            product = Product.objects.create(
+                product_code=f"SKU-M{i}", category=category, name=f"Игра {i}", slug=f"many-{i}", price=10
+            )
+            ProductKey.objects.bulk_create(
+                ProductKey(product=product, key_value=f"MANY-{i}-{j}") for j in range(3)
+            )
+            recalc_product_counters(product)
+            products.append(product)
+
+        def checkout(cart):
+            self.client.cookies[settings.CART_COOKIE_NAME] = SignedCookieCartStorage.encode(cart)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("checkout_start"))
+            self.assertRedirects(response, reverse("pay_order", args=[Order.objects.latest("id").id]),
+                                 fetch_redirect_response=False)
+            return len(queries)
+
+        # второй заказ, как и третий, снимает резерв брошенного предыдущего
+        checkout({str(products[0].id): 2})
+        single = checkout({str(products[0].id): 2})
+        many = checkout({str(product.id): 2 for product in products})
+        self.assertEqual(many, single)
+
+        order = Order.objects.latest("id")
+        self.assertEqual(order.held_keys.count(), 60)
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.stock, 1)
+
+        pay_through_stub(self.client, reverse("pay_order", args=[order.id]))
+        self.assertEqual(ProductKey.objects.filter(order_item__order=order, is_sold=True).count(), 60)
+        self.assertFalse(ProductKey.objects.filter(reserved_order=order).exists())
+
+
+@override_settings(CART_STORAGE="cookie", ORDER_HISTORY_PAGE_SIZE=5)
+class OrderHistoryTests(QueryBudgetMixin, TestCase):
+    """
+    История заказов постранично по курсору, чек — с проданными ключами.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.products = []
+        for i in range(2):
+            product = Product.objects.create(
+                product_code=f"SKU-{i}", category=category, name=f"Игра {i}", slug=f"game-{i}", price=100
+            )
+            for j in range(3):
+                ProductKey.objects.create(product=product, key_value=f"KEY-{i}-{j}")
+            cls.products.append(product)
+        cls.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+        for _ in range(12):
+            order = Order.objects.create(user=cls.user, total_price=100)
+            OrderItem.objects.create(order=order, product=cls.products[0], price=100, quantity=1)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_history_pages(self):
+        seen = []
+        url = reverse("order_history")
+        cursor = None
+        while True:
+            response = self.assertWithinQueryBudget(url, data={"cursor": cursor} if cursor else {})
+            seen.extend(order.id for order in response.context["orders"])
+            cursor = response.context["page"].next_cursor
+            if cursor is None:
+                break
+        expected = list(Order.objects.filter(user=self.user).order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_receipt_lists_sold_keys(self):
+        self.client.cookies[settings.CART_COOKIE_NAME] = SignedCookieCartStorage.encode(
+            {str(product.id): 2 for product in self.products}
+        )
+        pay_through_stub(self.client, self.client.get(reverse("checkout_start"))["Location"])
+        order = Order.objects.filter(user=self.user, status=Order.STATUS_PAID).get()
+
+        response = self.assertWithinQueryBudget(reverse("order_receipt", args=[order.id]))
+        keys = {
+            item.product_id: [key.key_value for key in item.keys.all()]
+            for item in response.context["order"].items.all()
+        }
+        self.assertEqual(keys, {
+            self.products[0].id: ["KEY-0-0", "KEY-0-1"],
+            self.products[1].id: ["KEY-1-0", "KEY-1-1"],
+        })
+
+    def test_receipt_of_other_user(self):
+        order = Order.objects.filter(user=self.user).first()
+        self.client.force_login(CustomUser.objects.create_user("other", "other@example.com", "password"))
+        self.assertEqual(self.client.get(reverse("order_receipt", args=[order.id])).status_code, 404)
+
+
+@override_settings(CART_STORAGE="cookie")
+class PaymentWebhookTests(TestCase):
+    """
+    Вебхук провайдера: проверка подписи, повторы — без повторной выдачи ключей.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.product = Product.objects.create(
+            product_code="SKU-0", category=category, name="Игра", slug="game", price=100
+        )
+        for j in range(3):
+            ProductKey.objects.create(product=cls.product, key_value=f"KEY-{j}")
+        cls.user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.client.cookies[settings.CART_COOKIE_NAME] = SignedCookieCartStorage.encode(
+            {str(self.product.id): 2}
+        )
+        self.client.get(self.client.get(reverse("checkout_start"))["Location"])
+        self.order = Order.objects.get(user=self.user)
+        self.url = reverse("payment_webhook", args=["stub"])
+
+    def deliver(self, status, payment_id=None):
+        body, headers = StubProvider().build_notification(payment_id or self.order.provider_payment_id, status)
+        return self.client.post(
+            self.url, body, content_type="application/json",
+            headers=headers,
+        )
+
+    def test_bad_signature_rejected(self):
+        response = self.client.post(
+            self.url, b'{"payment_id": "x", "status": "succeeded"}',
+            content_type="application/json",
+            headers={StubProvider.SIGNATURE_HEADER: "0" * 64},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_payment(self):
+        self.assertEqual(self.deliver("succeeded", payment_id="stub_missing").status_code, 404)
+
+    def test_duplicate_delivery_is_noop(self):
+        self.assertEqual(self.deliver("succeeded").json()["status"], "ok")
+        self.assertEqual(fulfill_paid_orders(), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.deliver("succeeded")
+        self.assertEqual(response.json()["status"], "duplicate")
+        # условный UPDATE и проверка существования — без выдачи ключей
+        self.assertLessEqual(len(queries), 4)
+        self.assertEqual(fulfill_paid_orders(), 0)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold_count), (1, 2))
+
+    def test_cancel_releases_hold(self):
+        self.assertEqual(self.deliver("canceled").json()["status"], "ok")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_CANCELED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_payment_after_cancel_flagged(self):
+        self.deliver("canceled")
+        with self.assertLogs("store.payments", "WARNING"):
+            self.assertEqual(self.deliver("succeeded").json()["status"], "ok")
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_PAID)
+        self.assertEqual(self.order.fulfillment_error, PAID_AFTER_CANCEL)
+        # в автоматическую выдачу не попадает
+        self.assertEqual(fulfill_paid_orders(), 0)
+        self.assertEqual(self.deliver("succeeded").json()["status"], "duplicate")
+
+    def test_failed_fulfillment_releases_hold(self):
+        # ключей на позицию не хватит: 2 в резерве и 1 свободный из 5
+        OrderItem.objects.filter(order=self.order).update(quantity=5)
+        self.deliver("succeeded")
+        with self.assertLogs("store.payments", "WARNING"):
+            self.assertEqual(fulfill_paid_orders(), 0)
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.fulfillment_error)
+        self.assertFalse(self.order.held_keys.exists())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold_count), (3, 0))
+
+    @override_settings(DEBUG=False, PAYMENT_PROVIDER="")
+    def test_stub_disabled_in_production(self):
+        self.assertFalse(stub_enabled())
+        self.assertEqual(self.deliver("succeeded").status_code, 404)
+        with self.assertRaises(ImproperlyConfigured):
+            get_provider()
+
+
+@override_settings(
+    MAIL_QUEUE_IN_PROCESS=False, MAIL_MAX_ATTEMPTS=3, MAIL_RETRY_BASE_SECONDS=60, MAIL_RETRY_MAX_SECONDS=90
+)
+class MailQueueTests(TestCase):
+    """
+    Очередь почты: отправка пачкой, повтор с экспоненциальной паузой, предел попыток.
+    """
+
+    def setUp(self):
+        self.email = enqueue_email("Тема", "Текст", to=["buyer@example.com"])
+
+    def refresh(self):
+        self.email.refresh_from_db()
+        return self.email
+
+    def make_due(self):
+        OutboundEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_sent(self):
+        self.assertEqual(deliver_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["buyer@example.com"])
+        self.assertEqual(self.refresh().status, OutboundEmail.STATUS_SENT)
+        self.assertEqual(deliver_pending(), 0)
+
+    def test_retry_delay_doubles_up_to_cap(self):
+        self.assertEqual(
+            [retry_delay(attempt).total_seconds() for attempt in (1, 2, 3)], [60, 90, 90]
+        )
+
+    def test_backoff_then_failed(self):
+        failing = mock.patch("store.mail.EmailMessage.send", side_effect=SMTPException("421"))
+        with failing, self.assertLogs("store.mail", "WARNING"):
+            started = timezone.now()
+            self.assertEqual(deliver_pending(), 0)
+            email = self.refresh()
+            self.assertEqual((email.status, email.attempts, email.last_error), (OutboundEmail.STATUS_PENDING, 1, "421"))
+            self.assertGreaterEqual(email.next_attempt_at, started + timedelta(seconds=60))
+
+            # пауза ещё не прошла — письмо не берётся
+            deliver_pending()
+            self.assertEqual(self.refresh().attempts, 1)
+
+            for _ in range(2):
+                self.make_due()
+                deliver_pending()
+        email = self.refresh()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.STATUS_FAILED, 3))
+
+        self.make_due()
+        self.assertEqual(deliver_pending(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_smtp_down_keeps_batch_pending(self):
+        with mock.patch("store.mail.get_connection") as get_connection, self.assertLogs("store.mail", "WARNING"):
+            get_connection.return_value.open.side_effect = OSError("connection refused")
+            self.assertEqual(deliver_pending(), 0)
+        email = self.refresh()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.STATUS_PENDING, 0))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        self.make_due()
+        self.assertEqual(deliver_pending(), 1)
+
+    def test_release_stuck(self):
+        OutboundEmail.objects.update(
+            status=OutboundEmail.STATUS_SENDING, next_attempt_at=timezone.now() - timedelta(minutes=11)
+        )
+        self.assertEqual(release_stuck(), 1)
+        self.assertEqual(deliver_pending(), 1)
+
+
+class SalesStatsTests(TestCase):
+    """
+    Дневная статистика продаж считается по дню оплаты, пересборка совпадает с онлайн-учётом.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.product = Product.objects.create(
+            product_code="SKU-0", category=category, name="Игра", slug="game", price=100
+        )
+        user = CustomUser.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.order = Order.objects.create(user=user, total_price=200)
+        OrderItem.objects.create(order=cls.order, product=cls.product, price=100, quantity=2)
+        # заказ создан позавчера, оплачен и выдан сегодня
+        now = timezone.now()
+        Order.objects.filter(id=cls.order.id).update(
+            created_at=now - timedelta(days=2), status=Order.STATUS_PAID, paid_at=now, fulfilled_at=now,
+        )
+        cls.order.refresh_from_db()
+
+    def stats(self):
+        return list(ProductSalesStats.objects.values_list("day", "quantity"))
+
+    def test_rebuild_buckets_by_payment_day(self):
+        record_order_sales(self.order)
+        recorded = self.stats()
+        self.assertEqual(recorded, [(timezone.localdate(), 2)])
+
+        self.assertEqual(rebuild_sales_stats(days=7), 1)
+        self.assertEqual(self.stats(), recorded)
+
+
+@override_settings(IMAGE_DERIVATIVES_IN_PROCESS=False)
+class ImageDerivativeTests(TestCase):
+    """
+    Производные картинок товара: строятся очередью, старые файлы удаляются при смене картинки.
+    """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.category = Category.objects.create(name="Игры", slug="games")
+
+    def upload(self, name, color, size=(800, 400)):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, color).save(buffer, format="PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_build_and_replace(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                product_code="SKU-0", category=self.category, name="Игра", slug="game", price=100,
+                image=self.upload("cover.png", "red"),
+            )
+        self.assertEqual(process_pending(), 1)
+
+        product.refresh_from_db()
+        variants = product.image_variants
+        self.assertEqual(variants["source"], product.image.name)
+        # шире оригинала не растягиваем
+        self.assertEqual([width for width, _ in variants["webp"]], [320, 480, 640])
+        old_files = variant_files(variants)
+        self.assertTrue(all(default_storage.exists(name) for name in old_files))
+
+        # запасной <img> карточки — оригинал, а не уменьшенная копия
+        card = product_cards(card_values(Product.objects.filter(pk=product.pk)))[0]
+        self.assertEqual(card.image_url, product.image.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self.upload("cover2.png", "blue")
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, {})
+        self.assertFalse(any(default_storage.exists(name) for name in old_files))
+
+        self.assertEqual(process_pending(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants["source"], product.image.name)
+
+    def test_removed_image_drops_files(self):
+        product = Product.objects.create(
+            product_code="SKU-0", category=self.category, name="Игра", slug="game", price=100,
+            image=self.upload("cover.png", "red"),
+        )
+        process_pending()
+        product.refresh_from_db()
+        old_files = variant_files(product.image_variants)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = None
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, {})
+        self.assertFalse(any(default_storage.exists(name) for name in old_files))
+
+
+class KeyImportTests(TestCase):
+    """
+    Загрузка ключей из файла: дубликаты и некорректные строки отсеиваются,
+    счётчики пересчитываются, файл не в UTF-8 не роняет загрузку.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.product = Product.objects.create(
+            product_code="SKU-0", category=category, name="Игра", slug="game", price=100
+        )
+        ProductKey.objects.create(product=cls.product, key_value="OLD-1")
+        cls.admin = CustomUser.objects.create_superuser("admin", "admin@example.com", "password")
+
+    def write(self, content, suffix=".txt"):
+        with tempfile.NamedTemporaryFile("wb", suffix=suffix, delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def assertStock(self, stock):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, stock)
+
+    def test_duplicates_and_invalid_rows(self):
+        lines = ["NEW-1", "NEW-2", "NEW-1", "OLD-1", "", "X" * (KEY_MAX_LENGTH + 1), "NEW-3"]
+        result = import_keys(self.product, iter(lines), batch_size=3)
+
+        self.assertEqual((result.created, result.duplicates, result.invalid), (3, 2, 1))
+        self.assertEqual(ProductKey.objects.filter(product=self.product).count(), 4)
+        self.assertStock(4)
+
+    def test_csv_first_column(self):
+        path = self.write(b"CSV-1,first\r\nCSV-2,second\r\n", suffix=".csv")
+        call_command("import_keys", "SKU-0", path, stdout=io.StringIO())
+        self.assertEqual(
+            set(ProductKey.objects.filter(key_value__startswith="CSV").values_list("key_value", flat=True)),
+            {"CSV-1", "CSV-2"},
+        )
+
+    def test_command_encoding(self):
+        path = self.write("КЛЮЧ-1\nКЛЮЧ-2\n".encode("cp1251"))
+        with self.assertRaisesMessage(CommandError, "--encoding"):
+            call_command("import_keys", "SKU-0", path, stdout=io.StringIO())
+
+        call_command("import_keys", "SKU-0", path, encoding="cp1251", stdout=io.StringIO())
+        self.assertTrue(ProductKey.objects.filter(key_value="КЛЮЧ-2").exists())
+        self.assertStock(3)
+
+    def test_admin_upload(self):
+        self.client.force_login(self.admin)
+        url = reverse("admin:store_product_import_keys", args=[self.product.pk])
+
+        upload = SimpleUploadedFile("keys.txt", "ADM-1\nАДМ-2\n".encode("cp1251"))
+        response = self.client.post(url, {"file": upload, "encoding": "utf-8-sig"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors["encoding"])
+
+        upload = SimpleUploadedFile("keys.txt", "ADM-1\nАДМ-2\n".encode("cp1251"))
+        response = self.client.post(url, {"file": upload, "encoding": "cp1251"})
+        self.assertRedirects(response, reverse("admin:store_product_change", args=[self.product.pk]))
+        self.assertTrue(ProductKey.objects.filter(key_value="АДМ-2").exists())
+        self.assertStock(3)
+
+
+class ProductKeyAdminTests(TestCase):
+    """
+    Список ключей в админке: число запросов не зависит от числа строк,
+    массовые действия — один запрос и один пересчёт счётчиков.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Игры", slug="games")
+        cls.products = [
+            Product.objects.create(
+                product_code=f"SKU-{i}", category=category, name=f"Игра {i}", slug=f"game-{i}", price=100
+            )
+            for i in range(2)
+        ]
+        for product in cls.products:
+            for j in range(5):
+                ProductKey.objects.create(product=product, key_value=f"KEY-{product.pk}-{j}")
+        cls.admin = CustomUser.objects.create_superuser("admin", "admin@example.com", "password")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = reverse("admin:store_productkey_changelist")
+
+    def test_changelist_queries_do_not_depend_on_rows(self):
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        ProductKey.objects.bulk_create(
+            ProductKey(product=self.products[0], key_value=f"EXTRA-{i}") for i in range(20)
+        )
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(few), len(many))
+
+    def test_search_is_exact(self):
+        key = ProductKey.objects.first()
+        response = self.client.get(self.url, {"q": key.key_value})
+        self.assertEqual(list(response.context["cl"].result_list), [key])
+        response = self.client.get(self.url, {"q": key.key_value[:-1]})
+        self.assertEqual(list(response.context["cl"].result_list), [])
+
+    def test_bulk_actions_recompute_counters(self):
+        product = self.products[0]
+        keys = list(product.keys.order_by("id").values_list("pk", flat=True))
+
+        self.client.post(self.url, {"action": "mark_keys_sold", "_selected_action": keys[:2]})
+        self.client.post(self.url, {"action": "delete_keys", "_selected_action": keys[2:3]})
+
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.sold_count), (2, 2))
+        self.assertEqual(product.keys.count(), 4)
+
+
+class StaticFilesTests(SimpleTestCase):
+    """
+    collectstatic склеивает и минифицирует наборы CSS, кладёт сжатые копии;
+    middleware отдаёт их по Accept-Encoding с вечным кэшем для имён с хэшем.
+    """
+
+    def setUp(self):
+        source, root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for path in (source, root):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        os.makedirs(os.path.join(source, "css"))
+        for name, css in (
+            ("a.css", "/* шапка */\nbody {\n  color : red;\n}\n" * 20),
+            ("b.css", "a :hover , p > b { margin: 0 ; }\n" * 20),
+        ):
+            with open(os.path.join(source, "css", name), "w") as fh:
+                fh.write(css)
+
+        override = self.settings(
+            STATICFILES_DIRS=[source],
+            STATIC_ROOT=root,
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+            STATIC_BUNDLES={"css/bundle.css": ["css/a.css", "css/b.css"]},
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        call_command("collectstatic", interactive=False, verbosity=0)
+        self.root = root
+        self.middleware = StaticFilesMiddleware(lambda request: HttpResponse("view"))
+
+    def get(self, path, **headers):
+        return self.middleware(RequestFactory().get(path, **headers))
+
+    def test_minify_css(self):
+        self.assertEqual(
+            minify_css("/* c */ a :hover , p > b {\n  color : red ;\n}"),
+            "a :hover,p>b{color :red}",
+        )
+
+    def test_bundle_hashed_minified_and_compressed(self):
+        hashed = staticfiles_storage.stored_name("css/bundle.css")
+        self.assertNotEqual(hashed, "css/bundle.css")
+        with open(os.path.join(self.root, hashed)) as fh:
+            bundle = fh.read()
+        self.assertTrue(bundle.startswith("body{color :red}"))
+        self.assertNotIn("шапка", bundle)
+        self.assertIn("a :hover,p>b{margin:0}", bundle)
+
+        with open(os.path.join(self.root, hashed + ".gz"), "rb") as fh:
+            self.assertEqual(gzip.decompress(fh.read()).decode(), bundle)
+
+    def test_middleware_serves_compressed_immutable(self):
+        url = staticfiles_storage.url("css/bundle.css")
+        response = self.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn("immutable", response["Cache-Control"])
+
+        plain = self.get(url)
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=plain["Last-Modified"]).status_code, 304)
+
+        # исходник без хэша — короткий кэш
+        self.assertNotIn("immutable", self.get(settings.STATIC_URL + "css/a.css")["Cache-Control"])
+
+    def test_middleware_respects_q_values(self):
+        url = staticfiles_storage.url("css/bundle.css")
+        # копия .br есть, только если установлен brotli, — кладём свою
+        with open(os.path.join(self.root, url[len(settings.STATIC_URL):] + ".br"), "wb") as fh:
+            fh.write(b"br")
+
+        for header, expected in (
+            ("br;q=0, gzip", "gzip"),
+            ("gzip;q=0.5, br;q=0.1", "br"),
+            ("br; q=0, gzip;q=0", None),
+            ("BR", "br"),
+            ("*", "br"),
+            ("*, br;q=0", "gzip"),
+            ("x-gzip, identity", None),
+            ("gzip;q=oops", None),
+        ):
+            with self.subTest(header=header):
+                response = self.get(url, HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response.get("Content-Encoding"), expected)
+
+    def test_middleware_passes_through(self):
+        for path in (settings.STATIC_URL + "../settings.py", settings.STATIC_URL + "css/missing.css", "/catalog/"):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path).content, b"view")
+
+
+@override_settings(REPLICA_DATABASES=["replica_0"])
+class ReplicaRouterTests(SimpleTestCase):
+    """
+    Каталог читается с реплики, пока запрос не закреплён за основной базой.
+    """
+
+    # без транзакции TestCase: внутри неё роутер всегда выбирает default
+    databases = {"default"}
+    router = ReplicaRouter()
+
+    def route(self, during_request, cookies=None):
+        request = RequestFactory().get("/")
+        request.COOKIES.update(cookies or {})
+        result = {}
+
+        def view(request):
+            result.update(during_request())
+            return HttpResponse()
+
+        response = ReplicaPinMiddleware(view)(request)
+        return result, response
+
+    def test_catalog_reads_go_to_replica(self):
+        result, _ = self.route(lambda: {
+            "product": self.router.db_for_read(Product),
+            "order": self.router.db_for_read(Order),
+        })
+        self.assertEqual(result, {"product": "replica_0", "order": "default"})
+
+    def test_outside_request_uses_primary(self):
+        self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_read_after_write_uses_primary(self):
+        def during_request():
+            self.router.db_for_write(Order)
+            return {"product": self.router.db_for_read(Product)}
+
+        result, _ = self.route(during_request)
+        self.assertEqual(result["product"], "default")
+
+    def test_transaction_uses_primary(self):
+        def during_request():
+            with transaction.atomic():
+                return {"product": self.router.db_for_read(Product)}
+
+        result, _ = self.route(during_request)
+        self.assertEqual(result["product"], "default")
+
+    def test_sticky_pin_survives_into_next_request(self):
+        _, response = self.route(lambda: pin_to_primary(sticky=True) or {})
+        self.assertIn("db_primary", response.cookies)
+
+        result, _ = self.route(
+            lambda: {"product": self.router.db_for_read(Product)},
+            cookies={"db_primary": "1"},
+        )
+        self.assertEqual(result["product"], "default")
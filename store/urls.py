@@ -1,10 +1,12 @@
 from django.urls import path
 from . import views
 from store.views import email_change_view, email_change_confirm
+from .payments import stub_enabled
 
 urlpatterns = [
     path('', views.home, name='index'),
     path('catalog/', views.catalog, name='catalog'),
+    path('search/', views.search, name='search'),
 
     # Корзина
     path('cart/', views.cart_view, name='cart'),
@@ -31,8 +33,18 @@ urlpatterns = [
 
     path("checkout/start/", views.checkout_start, name="checkout_start"),
     path("checkout/pay/<int:order_id>/", views.pay_order, name="pay_order"),
+    path("payments/webhook/<str:provider_name>/", views.payment_webhook, name="payment_webhook"),
+
+    path("profile/orders/", views.order_history, name="order_history"),
+    path("profile/orders/<int:order_id>/", views.order_receipt, name="order_receipt"),
 
     path("profile/email/", email_change_view, name="email_change"),
     path("verify-email-change/<uidb64>/<token>/", email_change_confirm, name="email_change_confirm"),
 
 ]
+
+# страница-заглушка оплаты — только в разработке или при явном PAYMENT_PROVIDER=stub
+if stub_enabled():
+    urlpatterns.append(
+        path("payments/stub/<str:payment_id>/", views.payment_stub, name="payment_stub")
+    )
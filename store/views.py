@@ -2,7 +2,8 @@ from django.contrib.auth import login, logout
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
-from django.core.mail import EmailMessage
+from .mail import enqueue_email
+from .images import is_image
 from django.template.loader import render_to_string
 from django.urls import reverse
 from .models import Product, Category, CustomUser
@@ -12,31 +13,77 @@ from django.contrib import messages
 from django.shortcuts import render, redirect
 from django.contrib.auth import update_session_auth_hash
 from .forms import ProfileForm, PasswordChangeCustomForm, EmailChangeForm
+from digitalnexus.db_router import use_primary
+from digitalnexus.instrumentation import query_budget
+from . import cache as store_cache
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from .pagination import akeyset_paginate, clamp_page_size, keyset_paginate
+from .search import matching_products, rank_products, search_facets
+from django.core.paginator import Paginator
+from django.db.models import Count, Max, Prefetch
+from .cards import ProductCard, aproduct_cards, card_values, product_cards
+from .conditional import conditional_page
+from .facets import acatalog_facets, histogram, parse_price, price_filter
+from .stats import atop_products
+from django.utils import timezone
+
+# Витринные вьюхи (главная, каталог, товар, корзина) асинхронные: под ASGI
+# ожидание БД не занимает поток. Всё, что нужно шаблону, достаётся заранее
+# через async ORM — ленивый запрос из шаблона в async-контексте запрещён.
+async def _load_user(request):
+    # шапка сайта читает user: грузим его (и сессию) асинхронно до рендера
+    request.user = await request.auser()
+
 
 # === Главная страница ===
-def home(request):
-    categories = Category.objects.all()
-
-    # сортируем по количеству проданных (sold_count) по убыванию
-    products = (
-        Product.objects
-        .filter(is_available=True)
-        .order_by("-sold_count", "-created_at")[:6]   # <= ВАЖНО
+@query_budget(6)
+async def home(request):
+    await _load_user(request)
+
+    async def load_categories():
+        return [category async for category in Category.objects.all().aiterator()]
+
+    # сортируем по количеству проданных (sold_count) по убыванию;
+    # в кэш кладутся лёгкие карточки, а не модели целиком
+    async def load_bestsellers():
+        return await aproduct_cards(
+            Product.objects
+            .filter(is_available=True)
+            .order_by("-sold_count", "-created_at")[:6]   # <= ВАЖНО
+        )
+
+    categories = await store_cache.acached_query(store_cache.CATEGORIES, "all", load_categories)
+    products = await store_cache.acached_query(store_cache.PRODUCTS, "bestsellers", load_bestsellers)
+    # хиты недели — из дневной статистики продаж; в ключе дата, чтобы окно сдвигалось
+    weekly_products = await store_cache.acached_query(
+        store_cache.PRODUCTS, f"top_week:{timezone.localdate()}", atop_products
     )
 
     return render(request, "store/index.html", {
         "categories": categories,
         "products": products,
+        "weekly_products": weekly_products,
+        # версия для {% cache %} — фрагмент с карточками сбрасывается вместе с данными
+        "products_version": await store_cache.aget_version(store_cache.PRODUCTS),
+        "cache_timeout": settings.STORE_CACHE_TIMEOUT,
     })
 
 
 
 
 # === Каталог ===
-def catalog(request):
+# sort из GET -> поле сортировки; без sort — как раньше, новинки сверху
+CATALOG_SORTS = {
+    "price_asc": "price",
+    "price_desc": "-price",
+    "new": "-created_at",
+}
+
+
+def _catalog_products(request):
     # Базовый запрос: только доступные товары
     products = Product.objects.filter(is_available=True)
-    categories = Category.objects.all()
 
     # ---------- фильтр по категории ----------
     category_slug = request.GET.get("category")
@@ -44,31 +91,111 @@ def catalog(request):
         products = products.filter(category__slug=category_slug)
 
     # ---------- фильтр по цене ----------
-    price_min = request.GET.get("min_price")
-    price_max = request.GET.get("max_price")
+    # некорректная цена в GET просто не применяется
+    products = products.filter(price_filter(*_catalog_prices(request)))
+
+    return products
+
+
+def _catalog_prices(request):
+    return parse_price(request.GET.get("min_price")), parse_price(request.GET.get("max_price"))
+
+
+async def _catalog_validators(request):
+    # одним агрегатом: свежайшее изменение и число товаров под фильтром
+    # (число ловит удаление и снятие с продажи); категории — по версии кэша
+    state = await _catalog_products(request).aaggregate(
+        modified_at=Max("updated_at"), count=Count("id")
+    )
+    categories_version = await store_cache.aget_version(store_cache.CATEGORIES)
+    # счётчики фасетов зависят и от товаров вне фильтра
+    products_version = await store_cache.aget_version(store_cache.PRODUCTS)
+    return state["modified_at"], (state["count"], categories_version, products_version)
 
-    if price_min:
-        products = products.filter(price__gte=price_min)
-    if price_max:
-        products = products.filter(price__lte=price_max)
 
-    # ---------- сортировка ----------
+@query_budget(6)
+@conditional_page(_catalog_validators)
+async def catalog(request):
+    await _load_user(request)
+
+    products = _catalog_products(request)
+    categories = [category async for category in Category.objects.all().aiterator()]
+
+    # ---------- сортировка + постраничный вывод по курсору ----------
     sort = request.GET.get("sort")
-    if sort == "price_asc":
-        products = products.order_by("price")
-    elif sort == "price_desc":
-        products = products.order_by("-price")
-    elif sort == "new":
-        products = products.order_by("-created_at")
-    # если sort пустой или что-то другое — оставляем порядок по умолчанию
+    order_field = CATALOG_SORTS.get(sort, "-created_at")
+    page_size = clamp_page_size(
+        request.GET.get("page_size"),
+        settings.CATALOG_PAGE_SIZE,
+        settings.CATALOG_PAGE_SIZE_MAX,
+    )
+    # в карточку идут только её поля; поле сортировки — для курсора
+    page = await akeyset_paginate(
+        card_values(products, order_field.lstrip("-")), order_field,
+        cursor=request.GET.get("cursor"),
+        page_size=page_size,
+        wrap=ProductCard,
+    )
+
+    # бесконечная прокрутка: следующая порция карточек тем же курсором
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "html": render_to_string(
+                "store/partials/product_cards.html",
+                {"products": page.items},
+                request=request,
+            ),
+            "next_cursor": page.next_cursor,
+        })
+
+    # ---------- фасеты: счётчики категорий и гистограмма цен ----------
+    facets = await acatalog_facets(*_catalog_prices(request))
+    selected = next((c for c in categories if c.slug == request.GET.get("category")), None)
 
     # ВАЖНО: передаём request в контекст, чтобы шаблон мог вернуть значения в инпуты
     return render(request, "store/catalog.html", {
-        "products": products,
+        "products": page.items,
+        "page": page,
         "categories": categories,
+        "category_facets": [
+            (category, facets["counts"].get(category.id, 0)) for category in categories
+        ],
+        "price_bounds": (facets["min_price"], facets["max_price"]),
+        "price_histogram": histogram(facets, selected.id if selected else None),
         "request": request,
     })
 
+# === Поиск ===
+@query_budget(7)
+def search(request):
+    query = request.GET.get("q", "").strip()
+    facets = None
+    page = None
+
+    if query:
+        products = matching_products(query)
+        # фасеты считаем по всем найденным, до фильтров — чтобы было куда переключиться
+        facets = search_facets(products)
+
+        category_slug = request.GET.get("category")
+        if category_slug:
+            products = products.filter(category__slug=category_slug)
+
+        # некорректная цена в GET просто не применяется, как в каталоге
+        products = products.filter(price_filter(*_catalog_prices(request)))
+
+        paginator = Paginator(card_values(rank_products(products, query)), settings.CATALOG_PAGE_SIZE)
+        page = paginator.get_page(request.GET.get("page"))
+
+    return render(request, "store/search.html", {
+        "query": query,
+        "page": page,
+        "products": product_cards(page.object_list) if page else [],
+        "facets": facets,
+        "request": request,
+    })
+
+
 # === Регистрация ===
 def register_view(request):
     if request.method == "POST":
@@ -93,8 +220,8 @@ def register_view(request):
                 {"user": user, "verify_url": verify_url},
             )
 
-            email = EmailMessage(subject, message, to=[user.email])
-            email.send(fail_silently=True)
+            # письмо уходит фоновым воркером — регистрация не ждёт SMTP
+            enqueue_email(subject, message, to=[user.email])
 
             return render(
                 request,
@@ -115,6 +242,7 @@ def login_view(request):
         if form.is_valid():
             user = form.get_user()
             login(request, user)
+            merge_cart_on_login(request)
             return redirect('index')
     else:
         form = LoginForm()
@@ -154,45 +282,55 @@ def profile_view(request):
 
 from django.shortcuts import get_object_or_404
 
-def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug)
+async def _product_validators(request, slug):
+    modified_at = await (
+        Product.objects.filter(slug=slug).values_list("updated_at", flat=True).afirst()
+    )
+    if modified_at is None:
+        return None
+    # на странице выводится категория товара
+    return modified_at, (await store_cache.aget_version(store_cache.CATEGORIES),)
+
+
+@query_budget(4)
+@conditional_page(_product_validators)
+async def product_detail(request, slug):
+    await _load_user(request)
+
+    try:
+        product = await Product.objects.select_related("category").aget(slug=slug)
+    except Product.DoesNotExist:
+        raise Http404("Товар не найден")
+
     return render(request, "store/product_detail.html", {"product": product})
 
 
 from django.shortcuts import get_object_or_404
+from .cart import Cart, merge_cart_on_login
 
 # ----------------- КОРЗИНА -----------------
 
-def cart_view(request):
-    cart = request.session.get("cart", {})
-    products = []
-    total_price = 0
-
-    for product_id, quantity in cart.items():
-        product = get_object_or_404(Product, id=product_id)
-        products.append({
-            "product": product,
-            "quantity": quantity,
-            "subtotal": product.price * quantity,
-        })
-        total_price += product.price * quantity
+@query_budget(4)
+async def cart_view(request):
+    await _load_user(request)
+    cart = Cart(request)
 
     return render(request, "store/cart.html", {
-        "products": products,
-        "total_price": total_price,
+        "products": await cart.alines(),
+        "total_price": cart.total_price,
     })
 
 
+@query_budget(6)
 def cart_add(request, product_id):
-    cart = request.session.get("cart", {})
+    cart = Cart(request)
     product = get_object_or_404(Product, id=product_id)
 
-    current_qty = cart.get(str(product_id), 0)
+    current_qty = cart.quantity(product_id)
     available = product.available_keys_count()
 
     if current_qty < available:
-        cart[str(product_id)] = current_qty + 1
-        request.session["cart"] = cart
+        cart.set(product_id, current_qty + 1)
     else:
         messages.error(request, "Недостаточно ключей в наличии ❗")
 
@@ -200,13 +338,9 @@ def cart_add(request, product_id):
 
 
 
+@query_budget(4)
 def cart_remove(request, product_id):
-    cart = request.session.get("cart", {})
-
-    if str(product_id) in cart:
-        del cart[str(product_id)]
-
-    request.session["cart"] = cart
+    Cart(request).remove(product_id)
     return redirect("cart")
 
 def verify_email(request, uidb64, token):
@@ -241,16 +375,22 @@ def password_change_view(request):
 
     return render(request, "store/password_change.html", {"form": form})
 
-from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth.decorators import login_required
 @login_required
 def upload_avatar(request):
     if request.method == "POST" and request.FILES.get("avatar"):
+        upload = request.FILES["avatar"]
+        if upload.size > settings.AVATAR_MAX_UPLOAD_SIZE:
+            return JsonResponse({"status": "error", "message": "Файл слишком большой"}, status=400)
+        if not is_image(upload):
+            return JsonResponse({"status": "error", "message": "Это не изображение"}, status=400)
+
         user = request.user
-        user.avatar = request.FILES["avatar"]
-        user.save()
+        user.avatar = upload
+        # уменьшенные копии строятся в фоне (сигнал avatar_saved)
+        user.save(update_fields=["avatar"])
         return JsonResponse({"status": "ok", "url": user.avatar.url})
 
     return JsonResponse({"status": "error"}, status=400)
@@ -258,78 +398,83 @@ def upload_avatar(request):
 
 @login_required
 def checkout(request):
-    cart = request.session.get("cart", {})
-    bought_keys = []
-
-    for product_id, qty in cart.items():
-        product = get_object_or_404(Product, id=product_id)
-
-        for _ in range(qty):
-            key = product.get_free_key()
-            if not key:
-                messages.error(request, f"Не хватает ключей для {product.name}")
-                return redirect("cart")
-
-            # помечаем ключ как использованный
-            key.is_active = False
-            key.save()
-
-            # сохраняем продукт и сам код ключа
-            bought_keys.append((product, key.key_value))
-
-    # очищаем корзину
-    request.session["cart"] = {}
-
-    return render(request, "store/checkout_success.html", {
-        "bought_keys": bought_keys,
-    })
-
-
-from .models import Order, OrderItem
-
+    # старый адрес оформления: ключи выдаются только через заказ
+    # (checkout_start -> резерв -> оплата -> allocate_keys), не в обход него
+    return redirect("checkout_start")
+
+
+from .models import Order, OrderItem, ProductKey
+from .keys import hold_keys, release_expired_holds, release_order_holds, NotEnoughKeys
+from .payments import (
+    CANCELED,
+    SUCCEEDED,
+    PaymentError,
+    StubProvider,
+    enabled_providers,
+    get_provider,
+    process_notification,
+    start_payment,
+)
+from django.views.decorators.http import require_POST
+from django.db import transaction
+
+# число запросов не зависит от числа позиций: ключи всех товаров
+# резервируются одним запросом и одним UPDATE (keys.hold_keys)
+@query_budget(16)
+@use_primary
 @login_required
 def checkout_start(request):
-    cart = request.session.get("cart", {})
-    if not cart:
+    cart = Cart(request)
+    lines = cart.lines()
+    if not lines:
         messages.error(request, "Корзина пуста.")
         return redirect("cart")
 
-    total_price = 0
-    # сначала проверяем наличие ключей и считаем сумму
-    for product_id, qty in cart.items():
-        product = get_object_or_404(Product, id=product_id)
+    # просроченные резервы товаров корзины и брошенные прошлые заказы
+    # покупателя возвращаем на склад, не дожидаясь release_expired_holds.
+    # Заказ, по которому платёж уже начат, не трогаем: успешный вебхук
+    # должен найти его ключи в резерве
+    release_expired_holds(line.product.id for line in lines)
+    release_order_holds(
+        Order.objects.filter(user=request.user, status=Order.STATUS_NEW, provider_payment_id="")
+    )
 
-        if qty > product.available_keys_count():
-            messages.error(
-                request,
-                f"Недостаточно ключей для товара «{product.name}»."
+    # заказ, позиции и резерв ключей — одной транзакцией: если ключей
+    # не хватает, заказ не создаётся
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(
+                user=request.user,
+                total_price=cart.total_price,
+                status=Order.STATUS_NEW,
+                provider=settings.PAYMENT_PROVIDER,
             )
-            return redirect("cart")
-
-        total_price += product.price * qty
 
-    # создаём заказ
-    order = Order.objects.create(
-        user=request.user,
-        total_price=total_price,
-        status=Order.STATUS_NEW,
-        provider="demo",
-    )
+            # создаём позиции заказа одним INSERT
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=line.product,
+                    quantity=line.quantity,
+                    price=line.product.price,
+                )
+                for line in lines
+            ])
 
-    # создаём позиции заказа
-    for product_id, qty in cart.items():
-        product = get_object_or_404(Product, id=product_id)
-        OrderItem.objects.create(
-            order=order,
-            product=product,
-            quantity=qty,
-            price=product.price,
+            hold_keys(order)
+    except NotEnoughKeys as exc:
+        messages.error(
+            request,
+            f"Недостаточно ключей для товара «{exc.product.name}»."
         )
+        return redirect("cart")
 
     # ВАЖНО: корзину здесь НЕ очищаем!
     return redirect("pay_order", order_id=order.id)
 
 
+@query_budget(6)
+@use_primary
 @login_required
 def pay_order(request, order_id):
     # ищем НЕоплаченный заказ текущего пользователя
@@ -340,40 +485,89 @@ def pay_order(request, order_id):
         status=Order.STATUS_NEW,
     )
 
-    bought_keys = []
+    # платёж создаётся один раз; оплату подтвердит вебхук провайдера,
+    # ключи выдаст fulfill_orders — запрос покупателя их не ждёт
+    checkout_url = start_payment(order)
 
-    # идём по позициям заказа, а НЕ по корзине
-    for item in order.items.select_related("product"):
-        product = item.product
+    # заказ остаётся в истории с кнопкой «Оплатить» — корзина больше не нужна
+    Cart(request).clear()
 
-        for _ in range(item.quantity):
-            key = product.get_free_key()
-            if not key:
-                messages.error(
-                    request,
-                    f"Не хватает ключей для товара «{product.name}». "
-                    f"Напишите в поддержку."
-                )
-                return redirect("cart")
+    return redirect(checkout_url)
 
-            # корректно помечаем как проданный
-            key.is_active = False
-            key.is_sold = True
-            key.save()
 
-            bought_keys.append((product, key.key_value))
+# === Оплата: вебхук провайдера и страница-заглушка ===
+@csrf_exempt
+@require_POST
+def payment_webhook(request, provider_name):
+    if provider_name not in enabled_providers():
+        raise Http404("Неизвестный провайдер")
+    provider = get_provider(provider_name)
 
-    # помечаем заказ оплаченным
-    order.status = Order.STATUS_PAID
-    order.save()
+    try:
+        notification = provider.parse_notification(request.body, request.headers)
+    except PaymentError as exc:
+        return JsonResponse({"status": "error", "message": str(exc)}, status=400)
 
-    # очищаем корзину только теперь
-    request.session["cart"] = {}
+    changed = process_notification(provider, notification)
+    if changed is None:
+        return JsonResponse({"status": "error", "message": "Платёж не найден"}, status=404)
+    # повтор доставки — тоже 200, иначе провайдер будет слать его снова
+    return JsonResponse({"status": "ok" if changed else "duplicate"})
+
+
+@login_required
+def payment_stub(request, payment_id):
+    order = get_object_or_404(
+        Order, provider=StubProvider.name, provider_payment_id=payment_id, user=request.user
+    )
+
+    if request.method == "POST":
+        status = SUCCEEDED if "pay" in request.POST else CANCELED
+        provider = get_provider(StubProvider.name)
+        # уведомление проходит тот же путь, что и вебхук: подпись, разбор, UPDATE
+        body, headers = provider.build_notification(payment_id, status)
+        process_notification(provider, provider.parse_notification(body, headers))
+        return redirect("order_receipt", order_id=order.id)
+
+    return render(request, "store/payment_stub.html", {"order": order})
+
+
+# === История заказов ===
+def _order_items(with_keys=False):
+    items = OrderItem.objects.select_related("product").only(
+        "id", "order_id", "price", "quantity", "product__id", "product__name", "product__slug"
+    )
+    if with_keys:
+        items = items.prefetch_related(Prefetch(
+            "keys", queryset=ProductKey.objects.only("id", "order_item_id", "key_value").order_by("id")
+        ))
+    return Prefetch("items", queryset=items.order_by("id"))
+
+
+@query_budget(5)
+@login_required
+def order_history(request):
+    # страница по курсору (индекс order_user_created_idx): сколько бы
+    # заказов ни было — запрос страницы и один запрос позиций к ней
+    orders = Order.objects.filter(user=request.user).prefetch_related(_order_items())
+    page = keyset_paginate(
+        orders, "-created_at",
+        cursor=request.GET.get("cursor"),
+        page_size=settings.ORDER_HISTORY_PAGE_SIZE,
+    )
+    return render(request, "store/orders.html", {"orders": page.items, "page": page})
+
+
+@query_budget(5)
+@login_required
+def order_receipt(request, order_id):
+    order = get_object_or_404(
+        Order.objects.prefetch_related(_order_items(with_keys=True)),
+        id=order_id,
+        user=request.user,
+    )
+    return render(request, "store/order_receipt.html", {"order": order})
 
-    return render(request, "store/checkout_success.html", {
-        "bought_keys": bought_keys,
-        "order": order,
-    })
 
 @login_required
 def email_change_view(request):
@@ -406,7 +600,7 @@ def email_change_view(request):
                 },
             )
 
-            EmailMessage(subject, message, to=[new_email]).send(fail_silently=True)
+            enqueue_email(subject, message, to=[new_email])
 
             messages.info(
                 request,